@@ -6,8 +6,10 @@ Adds database indexes to improve query performance
 
 import os
 import sys
+import hashlib
 from dotenv import load_dotenv
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 
 # Load environment variables
@@ -18,48 +20,145 @@ def get_db_connection():
     DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://dstent@localhost/sprout_budget")
     return psycopg2.connect(DATABASE_URL)
 
+# (index name, table and column definition) - built with CREATE INDEX CONCURRENTLY
+INDEXES = [
+    # Expenses table indexes
+    # Covering index: day/range listings read everything they need from the index
+    ("idx_expenses_user_ts_cat_covering", "expenses(user_id, timestamp DESC) INCLUDE (id, amount, description, category_id, category_type, category_ref_id)"),
+    # Serves "this user's expenses in this category over a date range", newest first;
+    # uncategorized rows are never looked up by category, so they are left out
+    ("idx_expenses_user_cat_ts_nn", "expenses(user_id, category_id, timestamp DESC) WHERE category_id IS NOT NULL"),
+    # Expenses are appended in roughly timestamp order, so a BRIN index serves wide
+    # historical range scans at a fraction of the size of a B-tree
+    ("idx_expenses_ts_brin", "expenses USING BRIN (timestamp) WITH (pages_per_range = 32)"),
+    
+    # User category budgets indexes
+    # Covering index: the category listing's budget joins become index-only scans
+    ("idx_ucb_user_type_cat", "user_category_budgets(user_id, category_type, category_id) INCLUDE (daily_budget)"),
+    ("idx_user_category_budgets_category", "user_category_budgets(category_id, category_type)"),
+    
+    # Custom categories indexes
+    # Also returns a user's categories already in name order for the listing
+    ("idx_custom_categories_user_name", "custom_categories(user_id, name)"),
+    
+    # User preferences indexes
+    ("idx_user_preferences_user", "user_preferences(user_id)"),
+    
+    # Password reset tokens indexes
+    # Partial covering index: token validation only looks at unused tokens and
+    # reads id/user_id/expires_at, so it can be answered by an index-only scan
+    ("idx_prt_token_active", "password_reset_tokens(token) INCLUDE (id, user_id, expires_at) WHERE used = FALSE"),
+    ("idx_password_reset_tokens_user", "password_reset_tokens(user_id)"),
+]
+
+# Indexes that have been superseded and should be removed
+OBSOLETE_INDEXES = [
+    "idx_expenses_category",  # Replaced by idx_expenses_user_cat_ts_nn
+    "idx_expenses_user_cat_ts",  # Replaced by the partial idx_expenses_user_cat_ts_nn
+    "idx_expenses_user_date",  # Day lookups use timestamp ranges on idx_expenses_user_ts_cat_covering
+    "idx_expenses_user_timestamp",  # Replaced by idx_expenses_user_ts_cat_covering
+    "idx_expenses_user_ts_covering",  # Replaced by idx_expenses_user_ts_cat_covering
+    "idx_user_category_budgets_user",  # Replaced by idx_ucb_user_type_cat
+    "idx_custom_categories_user",  # Replaced by idx_custom_categories_user_name
+    "idx_password_reset_tokens_token",  # Replaced by idx_prt_token_active (token is also UNIQUE)
+    "idx_password_reset_tokens_expires",  # Expired tokens are purged once per deploy by a sequential scan
+]
+
+def create_index_concurrently(cur, name, definition):
+    """Build one index without blocking writes, retrying once if a failed build left it INVALID"""
+    sql = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"
+    try:
+        cur.execute(sql)
+    except psycopg2.Error as e:
+        # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would skip
+        print(f"     ⚠️  Build failed ({e}), dropping any invalid index and retrying...")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cur.execute(sql)
+
+def get_valid_indexes(cur):
+    """Names of valid indexes in the current schema (INVALID leftovers are excluded so they get rebuilt)"""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND i.indisvalid
+    """)
+    return {row[0] for row in cur.fetchall()}
+
+def purge_expired_reset_tokens(cur):
+    """Delete password reset tokens that expired over a week ago so the table and its indexes stay small"""
+    cur.execute("DELETE FROM password_reset_tokens WHERE expires_at < NOW() - INTERVAL '7 days'")
+    print(f"🧹 Purged {cur.rowcount} expired password reset token(s)")
+
+def get_migration_id():
+    """Identify this index set so a changed INDEXES/OBSOLETE_INDEXES list runs again"""
+    digest = hashlib.sha1(repr((INDEXES, OBSOLETE_INDEXES)).encode('utf-8')).hexdigest()[:12]
+    return f"performance_indexes_{digest}"
+
 def add_performance_indexes():
     """Add performance indexes to improve query speed"""
     
-    indexes = [
-        # Expenses table indexes
-        "CREATE INDEX IF NOT EXISTS idx_expenses_user_timestamp ON expenses(user_id, timestamp)",
-        "CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category_id)",
-        "CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses(user_id, DATE(timestamp))",
-        
-        # User category budgets indexes
-        "CREATE INDEX IF NOT EXISTS idx_user_category_budgets_user ON user_category_budgets(user_id)",
-        "CREATE INDEX IF NOT EXISTS idx_user_category_budgets_category ON user_category_budgets(category_id, category_type)",
-        
-        # Custom categories indexes
-        "CREATE INDEX IF NOT EXISTS idx_custom_categories_user ON custom_categories(user_id)",
-        
-        # User preferences indexes
-        "CREATE INDEX IF NOT EXISTS idx_user_preferences_user ON user_preferences(user_id)",
-        
-        # Password reset tokens indexes
-        "CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens(token)",
-        "CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_user ON password_reset_tokens(user_id)",
-        "CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires ON password_reset_tokens(expires_at)"
-    ]
-    
     conn = None
     try:
         conn = get_db_connection()
+        # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
         cur = conn.cursor()
         
+        # Maintenance that runs on every deploy, even when the indexes are up to date
+        try:
+            purge_expired_reset_tokens(cur)
+        except Exception as e:
+            print(f"⚠️  Could not purge expired password reset tokens: {e}")
+        
+        # Deploys after the first are a single lookup once this index set has been applied
+        migration_id = get_migration_id()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                id TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("SELECT 1 FROM schema_migrations WHERE id = %s", (migration_id,))
+        if cur.fetchone():
+            print(f"✅ Performance indexes already applied ({migration_id}), nothing to do")
+            return True
+        
         print("🌱 Adding performance indexes to database...")
         
-        for i, index_sql in enumerate(indexes, 1):
+        existing = get_valid_indexes(cur)
+        failures = 0
+        for i, (name, definition) in enumerate(INDEXES, 1):
+            if name in existing:
+                print(f"  {i}/{len(INDEXES)}: Index {name} already exists, skipping")
+                continue
             try:
-                print(f"  {i}/{len(indexes)}: Adding index...")
-                cur.execute(index_sql)
+                print(f"  {i}/{len(INDEXES)}: Adding index {name}...")
+                create_index_concurrently(cur, name, definition)
                 print(f"     ✅ Index created successfully")
             except Exception as e:
-                print(f"     ⚠️  Index already exists or error: {e}")
+                failures += 1
+                print(f"     ⚠️  Could not create index {name}: {e}")
         
-        conn.commit()
-        print("\n🎉 All performance indexes added successfully!")
+        for name in OBSOLETE_INDEXES:
+            if name not in existing:
+                continue
+            try:
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            except Exception as e:
+                failures += 1
+                print(f"     ⚠️  Could not drop obsolete index {name}: {e}")
+        
+        # Only record the migration when everything applied, so failures are retried next deploy
+        if failures:
+            print(f"\n⚠️  {failures} index operation(s) failed and will be retried on the next run")
+        else:
+            cur.execute(
+                "INSERT INTO schema_migrations (id) VALUES (%s) ON CONFLICT (id) DO NOTHING",
+                (migration_id,)
+            )
+            print("\n🎉 All performance indexes added successfully!")
         print("📈 These indexes will improve query performance for:")
         print("   • Loading expenses and history")
         print("   • Category management")
@@ -68,8 +167,6 @@ def add_performance_indexes():
         
     except Exception as e:
         print(f"❌ Error adding indexes: {e}")
-        if conn:
-            conn.rollback()
         return False
     finally:
         if conn:
@@ -1,15 +1,20 @@
-from flask import Blueprint, request, jsonify, session
-from flask_mail import Message
+from flask import Blueprint, request, jsonify, session, current_app, g
+from flask_mail import Connection, Message
 import sendgrid
 from sendgrid.helpers.mail import Mail as SendGridMail
 from datetime import datetime, timedelta, timezone
+import html
 import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from utils import (
-    logger, run_query, hash_password, verify_password, validate_email, 
-    generate_reset_token, validate_auth_data, handle_errors, 
+    logger, run_query, run_tx, hash_password, verify_password, validate_email, 
+    generate_reset_token, validate_auth_data, 
     log_security_event, create_default_categories, DatabaseError, 
-    AuthenticationError, ValidationError
+    DatabaseConnectionError, AuthenticationError, ValidationError
 )
 
 # Create Blueprint for auth routes
@@ -18,67 +23,165 @@ auth_bp = Blueprint('auth', __name__)
 # Email configuration - will be imported after app creation
 mail = None
 
+# Email settings are read once at import rather than on every send
+SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY')
+BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5001')
+FROM_EMAIL = os.environ.get('FROM_EMAIL', 'noreply@sproutbudget.com')
+if not SENDGRID_API_KEY:
+    # Configuration doesn't change per request, so report it once at startup
+    logger.info("SendGrid API key not configured, password reset emails will use Gmail")
+
+# One SendGrid client per process so sends reuse its keep-alive HTTPS connection
+_sendgrid_client = None
+_sendgrid_client_lock = threading.Lock()
+
+# Reset emails are sent off the request thread, retrying with exponential backoff.
+# The delay is capped so a failing provider can't hold every pool thread asleep
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '4'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '3'))
+EMAIL_RETRY_MAX_DELAY = float(os.environ.get('EMAIL_RETRY_MAX_DELAY', '2'))
+_email_pool = ThreadPoolExecutor(max_workers=EMAIL_WORKERS, thread_name_prefix='email')
+
+# Hard cap on a single SendGrid API call or SMTP socket operation so a hung
+# connection can't hold a worker
+EMAIL_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_TIMEOUT_SECONDS', '5'))
+
+class _TimeoutConnection(Connection):
+    """Flask-Mail connection whose SMTP socket times out after EMAIL_TIMEOUT_SECONDS"""
+    
+    def configure_host(self):
+        # Same setup as Flask-Mail's own, which opens the socket with no timeout
+        smtp_class = smtplib.SMTP_SSL if self.mail.use_ssl else smtplib.SMTP
+        host = smtp_class(self.mail.server, self.mail.port, timeout=EMAIL_TIMEOUT_SECONDS)
+        host.set_debuglevel(int(self.mail.debug))
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+        return host
+
+class CircuitBreaker:
+    """
+    Stop calling an email provider after repeated failures
+
+    After `fail_max` consecutive failures the breaker opens and callers skip the
+    provider for `reset_timeout` seconds; the first call after that is let
+    through as a trial and either closes the breaker or reopens it.
+    """
+    
+    def __init__(self, name, fail_max=5, reset_timeout=30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """Whether the provider may be called right now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Half-open: allow one trial call and hold the rest off until it reports back
+                self._opened_at = time.monotonic()
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.fail_max:
+                if self._opened_at is None:
+                    logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+_sendgrid_breaker = CircuitBreaker('SendGrid')
+_gmail_breaker = CircuitBreaker('Gmail')
+
+# Password reset email HTML, built once at import and filled in per send
+_RESET_EMAIL_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+        .header {{ background: #4CAF50; color: white; padding: 20px; text-align: center; }}
+        .content {{ padding: 20px; background: #f9f9f9; }}
+        .button {{ background: #4CAF50; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; display: inline-block; margin: 20px 0; }}
+        .footer {{ color: #666; font-size: 12px; text-align: center; margin-top: 30px; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🌱 Sprout Budget Tracker</h1>
+        </div>
+        <div class="content">
+            <h2>Password Reset Request</h2>
+            <p>Hello {username},</p>
+            <p>You requested a password reset for your Sprout Budget Tracker account.</p>
+            <p><a href="{reset_url}" class="button">Reset Your Password</a></p>
+            <p><strong>This link will expire in 1 hour</strong> for security reasons.</p>
+            <p>If you didn't request this password reset, please ignore this email.</p>
+        </div>
+        <div class="footer">
+            <p>Best regards,<br>The Sprout Team</p>
+            <p>This is an automated message. Please do not reply to this email.</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
 def set_mail_instance(mail_instance):
     """Set the mail instance from main app"""
     global mail
     mail = mail_instance
 
+def _get_sendgrid_client():
+    """Return the shared SendGrid client, creating it on first use"""
+    global _sendgrid_client
+    if _sendgrid_client is None:
+        with _sendgrid_client_lock:
+            if _sendgrid_client is None:
+                client = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
+                client.client.timeout = EMAIL_TIMEOUT_SECONDS
+                _sendgrid_client = client
+    return _sendgrid_client
+
 def send_password_reset_email_sendgrid(user_email, username, reset_token, base_url=None):
     """Send password reset email using SendGrid (Professional)"""
     try:
-        # Get SendGrid API key from environment
-        sendgrid_api_key = os.environ.get('SENDGRID_API_KEY')
-        if not sendgrid_api_key:
-            logger.info("SendGrid API key not configured, falling back to Gmail")
+        if not SENDGRID_API_KEY:
+            return send_password_reset_email_gmail(user_email, username, reset_token, base_url)
+        
+        if not _sendgrid_breaker.allow():
+            # Provider is failing; go straight to the fallback instead of waiting on timeouts
             return send_password_reset_email_gmail(user_email, username, reset_token, base_url)
         
         # Create the reset URL (dynamic for production)
         if not base_url:
-            base_url = os.environ.get('BASE_URL', 'http://localhost:5001')
+            base_url = BASE_URL
         reset_url = f"{base_url}/reset-password.html?token={reset_token}"
         
-        # Create SendGrid client
-        sg = sendgrid.SendGridAPIClient(api_key=sendgrid_api_key)
-        
-        # Create HTML email content
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: #4CAF50; color: white; padding: 20px; text-align: center; }}
-                .content {{ padding: 20px; background: #f9f9f9; }}
-                .button {{ background: #4CAF50; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; display: inline-block; margin: 20px 0; }}
-                .footer {{ color: #666; font-size: 12px; text-align: center; margin-top: 30px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🌱 Sprout Budget Tracker</h1>
-                </div>
-                <div class="content">
-                    <h2>Password Reset Request</h2>
-                    <p>Hello {username},</p>
-                    <p>You requested a password reset for your Sprout Budget Tracker account.</p>
-                    <p><a href="{reset_url}" class="button">Reset Your Password</a></p>
-                    <p><strong>This link will expire in 1 hour</strong> for security reasons.</p>
-                    <p>If you didn't request this password reset, please ignore this email.</p>
-                </div>
-                <div class="footer">
-                    <p>Best regards,<br>The Sprout Team</p>
-                    <p>This is an automated message. Please do not reply to this email.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        sg = _get_sendgrid_client()
+        
+        # Fill in the prebuilt HTML template (the user-supplied values are escaped)
+        html_content = _RESET_EMAIL_HTML.format_map({
+            'username': html.escape(username),
+            'reset_url': html.escape(reset_url)
+        })
         
         # Create email message
         message = SendGridMail(
-            from_email=os.environ.get('FROM_EMAIL', 'noreply@sproutbudget.com'),
+            from_email=FROM_EMAIL,
             to_emails=user_email,
             subject="🌱 Reset Your Sprout Budget Password",
             html_content=html_content
@@ -86,17 +189,21 @@ def send_password_reset_email_sendgrid(user_email, username, reset_token, base_u
         
         # Send email
         response = sg.send(message)
+        _sendgrid_breaker.record_success()
         return True
         
     except Exception as e:
+        _sendgrid_breaker.record_failure()
         return send_password_reset_email_gmail(user_email, username, reset_token, base_url)
 
 def send_password_reset_email_gmail(user_email, username, reset_token, base_url=None):
     """Send password reset email using Gmail (Fallback)"""
+    if not _gmail_breaker.allow():
+        return False
     try:
         # Create the reset URL (dynamic for production)
         if not base_url:
-            base_url = os.environ.get('BASE_URL', 'http://localhost:5001')
+            base_url = BASE_URL
         reset_url = f"{base_url}/reset-password.html?token={reset_token}"
         
         # Create email message
@@ -121,19 +228,44 @@ The Sprout Team
 This is an automated message. Please do not reply to this email."""
         )
         
-        mail.send(msg)
+        with _TimeoutConnection(current_app.extensions['mail']) as connection:
+            connection.send(msg)
+        _gmail_breaker.record_success()
         return True
     except Exception as e:
+        _gmail_breaker.record_failure()
         return False
 
+def _send_password_reset_email_sync(app, user_email, username, reset_token, base_url=None):
+    """Deliver a reset email from a worker thread, retrying with exponential backoff"""
+    # Flask-Mail needs an application context, which worker threads don't have
+    with app.app_context():
+        for attempt in range(EMAIL_MAX_ATTEMPTS):
+            if send_password_reset_email_sendgrid(user_email, username, reset_token, base_url):
+                return True
+            if attempt + 1 < EMAIL_MAX_ATTEMPTS:
+                time.sleep(min(2 ** attempt, EMAIL_RETRY_MAX_DELAY))
+        logger.error("Failed to send password reset email after %d attempts", EMAIL_MAX_ATTEMPTS)
+        return False
+
+def _log_email_outcome(future):
+    """Done-callback for queued reset emails, so a crashed send isn't silently lost"""
+    # Failed attempts are already logged by the task; this catches anything it raised
+    if future.cancelled():
+        logger.warning("Password reset email was cancelled before it was sent")
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("Password reset email task crashed", exc_info=error)
+
 def send_password_reset_email(user_email, username, reset_token, base_url=None):
-    """Send password reset email (tries SendGrid first, falls back to Gmail)"""
-    # Check environment variables
-    sendgrid_api_key = os.environ.get('SENDGRID_API_KEY')
-    mail_username = os.environ.get('MAIL_USERNAME')
-    mail_password = os.environ.get('MAIL_PASSWORD')
-    
-    return send_password_reset_email_sendgrid(user_email, username, reset_token, base_url)
+    """Queue a password reset email (tries SendGrid first, falls back to Gmail) and return its Future"""
+    app = current_app._get_current_object()
+    future = _email_pool.submit(
+        _send_password_reset_email_sync, app, user_email, username, reset_token, base_url
+    )
+    future.add_done_callback(_log_email_outcome)
+    return future
 
 def require_auth(f):
     """Decorator to require authentication for protected routes"""
@@ -141,18 +273,21 @@ def require_auth(f):
     
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        user_id = session.get('user_id')
+        if user_id is None:
             return jsonify({'error': 'Authentication required'}), 401
+        # Views and helpers read the id from g for the rest of the request
+        g.user_id = user_id
         return f(*args, **kwargs)
     return decorated_function
 
 def get_current_user_id():
-    """Get the current user's ID from session"""
-    return session.get('user_id')
+    """Get the current user's ID (set on g by require_auth, otherwise from the session)"""
+    user_id = g.get('user_id')
+    return user_id if user_id is not None else session.get('user_id')
 
 # Authentication Routes
 @auth_bp.route('/signup', methods=['POST'])
-@handle_errors
 def signup():
     """User registration with email-only authentication"""
     # Enhanced request parsing with better error handling
@@ -181,40 +316,33 @@ def signup():
     
     # Hash password and create user
     password_hash = hash_password(password)
-    sql = '''
-        INSERT INTO users (email, password_hash)
-        VALUES (%s, %s)
-        RETURNING id, email
-    '''
-    result = run_query(sql, (email, password_hash), fetch_one=True)
     
-    if not result:
-        raise DatabaseError("Failed to create account. Please try again.")
-        
-    user_id = result['id']
-    logger.info("User created successfully", extra={'user_id': user_id, 'email': email})
+    def create_account(cur):
+        cur.execute('''
+            INSERT INTO users (email, password_hash)
+            VALUES (%s, %s)
+            RETURNING id, email
+        ''', (email, password_hash))
+        user = cur.fetchone()
+        if not user:
+            raise DatabaseError("Failed to create account. Please try again.")
+        # Create default categories and preferences for new user
+        create_default_categories(user['id'], cur)
+        return user
     
-    # Create default categories and preferences for new user
+    # The user and their defaults commit together, so a failure leaves nothing behind
     try:
-        create_default_categories(user_id)
-        logger.info("Default categories created", extra={'user_id': user_id})
-    except Exception as cat_error:
-        # If categories creation fails, delete the user to maintain consistency
-        logger.error("Failed to create default categories, rolling back user creation", extra={
-            'user_id': user_id,
-            'error': str(cat_error)
+        result = run_tx(create_account)
+    except DatabaseConnectionError as setup_error:
+        logger.error("Failed to create account, transaction rolled back", extra={
+            'email': email,
+            'error': str(setup_error)
         })
-        try:
-            delete_sql = 'DELETE FROM users WHERE id = %s'
-            run_query(delete_sql, (user_id,), fetch_all=False)
-            logger.info("User creation rolled back", extra={'user_id': user_id})
-        except Exception as delete_error:
-            logger.error("Failed to rollback user creation", extra={
-                'user_id': user_id,
-                'error': str(delete_error)
-            })
         raise DatabaseError("Failed to set up account. Please try again.")
     
+    user_id = result['id']
+    logger.info("User created successfully", extra={'user_id': user_id, 'email': email})
+    
     # Automatically log the user in after successful signup
     session.clear()  # Clear any existing session
     session['user_id'] = user_id
@@ -232,7 +360,6 @@ def signup():
     }), 201
 
 @auth_bp.route('/login', methods=['POST'])
-@handle_errors
 def login():
     """User login with email and password"""
     # Enhanced request parsing with better error handling
@@ -333,7 +460,7 @@ def forgot_password():
             base_url = f"{scheme}://{host}"
         else:
             # Fallback to environment variable or default
-            base_url = os.environ.get('BASE_URL', 'http://localhost:5001')
+            base_url = BASE_URL
         
         # Check if user exists
         user = run_query(
@@ -352,10 +479,10 @@ def forgot_password():
                 INSERT INTO password_reset_tokens (user_id, token, expires_at)
                 VALUES (%s, %s, %s)
             '''
-            run_query(sql, (user['id'], reset_token, expires_at), fetch_all=False)
+            run_query(sql, (user['id'], reset_token, expires_at), fetch_all=False, write=True)
             
-            # Send email (use email as display name since no username)
-            email_sent = send_password_reset_email(user['email'], user['email'], reset_token, base_url)
+            # Queue email (use email as display name since no username)
+            send_password_reset_email(user['email'], user['email'], reset_token, base_url)
         
         # Always return the same message for security
         return jsonify({
@@ -400,14 +527,16 @@ def reset_password():
         run_query(
             'UPDATE users SET password_hash = %s WHERE id = %s',
             (password_hash, token_data['user_id']),
-            fetch_all=False
+            fetch_all=False,
+            write=True
         )
         
         # Mark token as used
         run_query(
             'UPDATE password_reset_tokens SET used = TRUE WHERE id = %s',
             (token_data['token_id'],),
-            fetch_all=False
+            fetch_all=False,
+            write=True
         )
         
         return jsonify({'message': 'Password reset successful! You can now log in with your new password.'}), 200
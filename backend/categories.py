@@ -1,15 +1,32 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 
 from utils import (
-    logger, run_query, validate_category_data, handle_errors, 
-    get_day_bounds, get_user_daily_limit,
-    ValidationError, _cache, _cache_timestamps
+    logger, run_query, run_prepared, run_tx, run_bulk_insert, validate_category_data, 
+    get_day_bounds, parse_day_offset, to_db_timestamp, get_user_daily_limit, json_response,
+    get_cached_data, set_cached_data, delete_cached_data, ValidationError
 )
 from auth import require_auth, get_current_user_id
 
 # Create Blueprint for category routes
 categories_bp = Blueprint('categories', __name__)
 
+# Seconds a user's rendered category list may be served from cache; writes invalidate it sooner
+CATEGORIES_CACHE_SECONDS = 60
+
+def _invalidate_categories_cache(user_id):
+    """Drop the cached category list after the user's categories or budgets change"""
+    delete_cached_data(f"categories_{user_id}")
+    delete_cached_data(f"category_rows_{user_id}")
+
+def get_user_categories_cached(user_id):
+    """The user's categories with their daily budgets as plain dicts, cached like the category list"""
+    cache_key = f"category_rows_{user_id}"
+    categories = get_cached_data(cache_key, max_age_seconds=CATEGORIES_CACHE_SECONDS)
+    if categories is None:
+        categories = [dict(row) for row in run_prepared('user_categories', (user_id,))]
+        set_cached_data(cache_key, categories)
+    return categories
+
 @categories_bp.route('/categories', methods=['GET'])
 @require_auth
 def get_categories():
@@ -17,56 +34,19 @@ def get_categories():
     try:
         user_id = get_current_user_id()
         
+        cache_key = f"categories_{user_id}"
+        cached = get_cached_data(cache_key, max_age_seconds=CATEGORIES_CACHE_SECONDS)
+        if cached is not None:
+            return Response(cached, mimetype='application/json')
+        
         try:
-            # OPTIMIZED: Single query with UNION to get all categories and budgets
-            optimized_sql = '''
-                SELECT 
-                    'default_' || dc.id as id,
-                    dc.name,
-                    dc.icon,
-                    dc.color,
-                    dc.created_at,
-                    COALESCE(ucb.daily_budget, 0.0) as daily_budget,
-                    true as is_default,
-                    false as is_custom
-                FROM default_categories dc
-                LEFT JOIN user_category_budgets ucb ON ucb.category_id = dc.id AND ucb.category_type = 'default' AND ucb.user_id = %s
-                
-                UNION ALL
-                
-                SELECT 
-                    'custom_' || cc.id as id,
-                    cc.name,
-                    cc.icon,
-                    cc.color,
-                    cc.created_at,
-                    COALESCE(ucb.daily_budget, cc.daily_budget) as daily_budget,
-                    false as is_default,
-                    true as is_custom
-                FROM custom_categories cc
-                LEFT JOIN user_category_budgets ucb ON ucb.category_id = cc.id AND ucb.category_type = 'custom' AND ucb.user_id = %s
-                WHERE cc.user_id = %s
-                
-                ORDER BY name ASC
-            '''
-            
-            categories_raw = run_query(optimized_sql, (user_id, user_id, user_id), fetch_all=True)
+            # Rows already match the response shape: NUMERIC arrives as float and orjson
+            # renders created_at, so there is nothing to convert per row
+            categories = run_prepared('user_categories', (user_id,))
             
-            # Format the results
-            categories = []
-            for cat in categories_raw:
-                categories.append({
-                    'id': cat['id'],
-                    'name': cat['name'],
-                    'icon': cat['icon'],
-                    'color': cat['color'],
-                    'daily_budget': float(cat['daily_budget']),
-                    'is_default': cat['is_default'],
-                    'is_custom': cat['is_custom'],
-                    'created_at': cat['created_at'].isoformat() if hasattr(cat['created_at'], 'isoformat') else str(cat['created_at'])
-                })
-            
-            return jsonify(categories)
+            response = json_response(categories)
+            set_cached_data(cache_key, response.get_data())
+            return response
             
         except Exception as db_error:
             logger.error(f"Database error getting categories: {db_error}")
@@ -163,47 +143,48 @@ def create_category():
         
         user_id = get_current_user_id()
         
-        # Check if category name already exists for this user
-        check_sql = 'SELECT id FROM custom_categories WHERE user_id = %s AND name = %s'
-        existing = run_query(check_sql, (user_id, name), fetch_one=True)
-        if existing:
-            return jsonify({'error': 'A category with this name already exists'}), 400
-        
-        # Create the custom category
-        insert_sql = '''
-            INSERT INTO custom_categories (user_id, name, icon, color, daily_budget)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-        '''
-        result = run_query(insert_sql, (user_id, name, icon, color, daily_budget), fetch_one=True)
-        
-        if result:
-            category_id = result['id']
+        def create(cur):
+            # Check if category name already exists for this user
+            cur.execute('SELECT id FROM custom_categories WHERE user_id = %s AND name = %s', (user_id, name))
+            if cur.fetchone():
+                return None
+            
+            # Create the custom category
+            cur.execute('''
+                INSERT INTO custom_categories (user_id, name, icon, color, daily_budget)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (user_id, name, icon, color, daily_budget))
+            category_id = cur.fetchone()['id']
             
             # If daily_budget is set, also create a budget entry
             if daily_budget > 0:
-                budget_sql = '''
+                cur.execute('''
                     INSERT INTO user_category_budgets (user_id, category_id, category_type, daily_budget)
                     VALUES (%s, %s, 'custom', %s)
                     ON CONFLICT (user_id, category_id, category_type) 
                     DO UPDATE SET daily_budget = EXCLUDED.daily_budget, updated_at = CURRENT_TIMESTAMP
-                '''
-                run_query(budget_sql, (user_id, category_id, daily_budget))
-            
-            return jsonify({
-                'success': True,
-                'category': {
-                    'id': f'custom_{category_id}',
-                    'name': name,
-                    'icon': icon,
-                    'color': color,
-                    'daily_budget': float(daily_budget),
-                    'is_default': False,
-                    'is_custom': True
-                }
-            }), 201
-        else:
-            return jsonify({'error': 'Failed to create category'}), 500
+                ''', (user_id, category_id, daily_budget))
+            return category_id
+        
+        # Name check, insert and budget share one connection and one commit
+        category_id = run_tx(create)
+        if category_id is None:
+            return jsonify({'error': 'A category with this name already exists'}), 400
+        _invalidate_categories_cache(user_id)
+        
+        return jsonify({
+            'success': True,
+            'category': {
+                'id': f'custom_{category_id}',
+                'name': name,
+                'icon': icon,
+                'color': color,
+                'daily_budget': float(daily_budget),
+                'is_default': False,
+                'is_custom': True
+            }
+        }), 201
             
     except Exception as e:
         logger.error(f"Error creating category: {e}")
@@ -237,31 +218,37 @@ def update_category_budget(category_id):
                 'success': False
             }), 400
         
-        # Check if category exists and belongs to the user
-        check_sql = 'SELECT id, name FROM categories WHERE id = %s AND user_id = %s'
-        category = run_query(check_sql, (category_id, user_id), fetch_one=True)
-        if not category:
+        def update(cur):
+            # Check if category exists and belongs to the user
+            cur.execute('SELECT id, name FROM categories WHERE id = %s AND user_id = %s', (category_id, user_id))
+            if not cur.fetchone():
+                return None
+            
+            # Update category budget
+            cur.execute('''
+                UPDATE categories 
+                SET daily_budget = %s 
+                WHERE id = %s
+                RETURNING id, name, daily_budget
+            ''', (daily_budget, category_id))
+            return cur.fetchone() or {}
+        
+        # Ownership check and update run in one transaction
+        result = run_tx(update)
+        if result is None:
             return jsonify({
                 'error': 'Category not found',
                 'success': False
             }), 404
         
-        # Update category budget
-        sql = '''
-            UPDATE categories 
-            SET daily_budget = %s 
-            WHERE id = %s
-            RETURNING id, name, daily_budget
-        '''
-        result = run_query(sql, (daily_budget, category_id), fetch_one=True)
-        
         if result:
+            _invalidate_categories_cache(user_id)
             return jsonify({
                 'category_id': result['id'],
                 'category_name': result['name'],
-                'daily_budget': float(result['daily_budget']),
+                'daily_budget': result['daily_budget'],
                 'success': True,
-                'message': f"Budget for {result['name']} updated to ${float(result['daily_budget']):.2f}/day"
+                'message': f"Budget for {result['name']} updated to ${result['daily_budget']:.2f}/day"
             })
         else:
             return jsonify({
@@ -292,6 +279,9 @@ def update_multiple_category_budgets():
         
         updated_categories = []
         errors = []
+        # (category_type, category_id) -> (submitted id, budget); keyed so the legacy
+        # "3" and "default_3" forms of one category collapse into a single upsert row
+        submitted = {}
         
         for category_id_str, daily_budget in budgets.items():
             try:
@@ -305,54 +295,63 @@ def update_multiple_category_budgets():
                 if category_id_str.startswith('default_'):
                     category_type = 'default'
                     category_id = int(category_id_str.replace('default_', ''))
-                    
-                    # Check if default category exists
-                    check_sql = 'SELECT id, name FROM default_categories WHERE id = %s'
-                    category_exists = run_query(check_sql, (category_id,), fetch_one=True)
-                    
                 elif category_id_str.startswith('custom_'):
                     category_type = 'custom'
                     category_id = int(category_id_str.replace('custom_', ''))
-                    
-                    # Check if custom category exists and belongs to user
-                    check_sql = 'SELECT id, name FROM custom_categories WHERE id = %s AND user_id = %s'
-                    category_exists = run_query(check_sql, (category_id, user_id), fetch_one=True)
-                    
                 else:
                     # Legacy format - assume it's a default category
                     category_type = 'default'
                     category_id = int(category_id_str)
-                    
-                    check_sql = 'SELECT id, name FROM default_categories WHERE id = %s'
-                    category_exists = run_query(check_sql, (category_id,), fetch_one=True)
                 
-                if not category_exists:
-                    errors.append(f"Category {category_id_str}: not found")
-                    continue
-                
-                # Update or insert budget in user_category_budgets table
-                budget_sql = '''
-                    INSERT INTO user_category_budgets (user_id, category_id, category_type, daily_budget)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (user_id, category_id, category_type) 
-                    DO UPDATE SET daily_budget = EXCLUDED.daily_budget, updated_at = CURRENT_TIMESTAMP
-                    RETURNING daily_budget
-                '''
-                result = run_query(budget_sql, (user_id, category_id, category_type, daily_budget), fetch_one=True)
-                
-                if result:
-                    updated_categories.append({
-                        'category_id': category_id_str,
-                        'category_name': category_exists['name'],
-                        'daily_budget': float(result['daily_budget'])
-                    })
-                else:
-                    errors.append(f"Category {category_id_str}: failed to update budget")
+                submitted[(category_type, category_id)] = (category_id_str, daily_budget)
                     
             except (ValueError, TypeError):
                 errors.append(f"Category {category_id_str}: invalid budget value")
-            except Exception as e:
-                errors.append(f"Category {category_id_str}: {str(e)}")
+        
+        # Check every submitted category (custom ones must belong to the user) in one query
+        # (category_type, category_id) -> (submitted id, category name, budget)
+        pending = {}
+        if submitted:
+            default_ids = [cid for (ctype, cid) in submitted if ctype == 'default']
+            custom_ids = [cid for (ctype, cid) in submitted if ctype == 'custom']
+            existing = run_query('''
+                SELECT 'default' AS category_type, id, name FROM default_categories
+                WHERE id = ANY(%s::int[])
+                UNION ALL
+                SELECT 'custom', id, name FROM custom_categories
+                WHERE user_id = %s AND id = ANY(%s::int[])
+            ''', (default_ids, user_id, custom_ids), fetch_all=True)
+            names = {(row['category_type'], row['id']): row['name'] for row in existing}
+            
+            for key, (category_id_str, daily_budget) in submitted.items():
+                if key not in names:
+                    errors.append(f"Category {category_id_str}: not found")
+                    continue
+                pending[key] = (category_id_str, names[key], daily_budget)
+        
+        # Update or insert all budgets in user_category_budgets with one statement
+        if pending:
+            budget_sql = '''
+                INSERT INTO user_category_budgets (user_id, category_id, category_type, daily_budget)
+                VALUES %s
+                ON CONFLICT (user_id, category_id, category_type) 
+                DO UPDATE SET daily_budget = EXCLUDED.daily_budget, updated_at = CURRENT_TIMESTAMP
+                RETURNING category_id, category_type, daily_budget
+            '''
+            rows = [
+                (user_id, category_id, category_type, daily_budget)
+                for (category_type, category_id), (_, _, daily_budget) in pending.items()
+            ]
+            results = run_bulk_insert(budget_sql, rows, template='(%s, %s, %s, %s)', returning=True)
+            _invalidate_categories_cache(user_id)
+            
+            for result in results:
+                category_id_str, category_name, _ = pending[(result['category_type'], result['category_id'])]
+                updated_categories.append({
+                    'category_id': category_id_str,
+                    'category_name': category_name,
+                    'daily_budget': result['daily_budget']
+                })
         
         if updated_categories:
             response = {
@@ -381,42 +380,23 @@ def update_multiple_category_budgets():
 def get_category_budget_tracking():
     """Get category budget tracking for today - spending vs. budget for each category"""
     try:
-        day_offset = int(request.args.get('dayOffset', 0))
+        day_offset = parse_day_offset()
         user_id = get_current_user_id()
         today_start, today_end = get_day_bounds(day_offset, user_id)
         
         try:
-            # Get all categories with their budgets for the current user (new normalized structure)
-            categories_sql = '''
-                SELECT 
-                    'default_' || dc.id as id,
-                    dc.name,
-                    dc.icon,
-                    dc.color,
-                    COALESCE(ucb.daily_budget, 0.0) as daily_budget
-                FROM default_categories dc
-                LEFT JOIN user_category_budgets ucb ON ucb.category_id = dc.id 
-                    AND ucb.category_type = 'default' 
-                    AND ucb.user_id = %s
-                
-                UNION ALL
-                
-                SELECT 
-                    'custom_' || cc.id as id,
-                    cc.name,
-                    cc.icon,
-                    cc.color,
-                    COALESCE(ucb.daily_budget, cc.daily_budget, 0.0) as daily_budget
-                FROM custom_categories cc
-                LEFT JOIN user_category_budgets ucb ON ucb.category_id = cc.id 
-                    AND ucb.category_type = 'custom' 
-                    AND ucb.user_id = %s
-                WHERE cc.user_id = %s
-                
-                ORDER BY name ASC
-            '''
-            categories = run_query(categories_sql, (user_id, user_id, user_id), fetch_all=True)
-            budgeted_count = sum(1 for cat in categories if cat['daily_budget'] > 0)
+            # Categories and budgets change rarely and come from cache; only today's
+            # spending per category is read on every request
+            categories = get_user_categories_cached(user_id)
+            spending_rows = run_prepared(
+                'expenses_spent_by_category',
+                (user_id, to_db_timestamp(today_start), to_db_timestamp(today_end)),
+                as_dict=False
+            )
+            spent_by_category = {
+                f"{'default' if category_type == 0 else 'custom'}_{category_ref_id}": total
+                for category_type, category_ref_id, total in spending_rows
+            }
         except Exception as db_error:
             logger.error(f"Database error getting categories for budget tracking: {db_error}")
             # Return empty budget tracking if database fails
@@ -436,37 +416,6 @@ def get_category_budget_tracking():
                 'success': True
             })
         
-        try:
-            # Get today's spending by category (handle new category ID format)
-            spending_sql = '''
-                SELECT 
-                    CASE 
-                        WHEN e.category_id LIKE 'default_%%' THEN e.category_id
-                        WHEN e.category_id LIKE 'custom_%%' THEN e.category_id
-                        ELSE CONCAT('default_', e.category_id) -- Legacy format
-                    END as category_id,
-                    SUM(e.amount) as total_spent
-                FROM expenses e
-                WHERE e.user_id = %s AND e.timestamp >= %s AND e.timestamp < %s
-                GROUP BY 
-                    CASE 
-                        WHEN e.category_id LIKE 'default_%%' THEN e.category_id
-                        WHEN e.category_id LIKE 'custom_%%' THEN e.category_id
-                        ELSE CONCAT('default_', e.category_id)
-                    END
-            '''
-            spending_data = run_query(spending_sql, (user_id, today_start.isoformat(), today_end.isoformat()), fetch_all=True)
-        except Exception as db_error:
-            logger.error(f"Database error getting spending data: {db_error}")
-            spending_data = []
-        
-        # Create spending lookup
-        spending_by_category = {}
-        for row in spending_data:
-            category_id = row['category_id']
-            spent = float(row['total_spent'])
-            spending_by_category[category_id] = spent
-        
         # Separate budgeted and unbedgeted categories
         budgeted_categories = []
         unbedgeted_categories = []
@@ -475,8 +424,8 @@ def get_category_budget_tracking():
         total_spent_unbedgeted = 0
         
         for cat in categories:
-            budget = float(cat['daily_budget']) if cat['daily_budget'] else 0.0
-            spent = spending_by_category.get(cat['id'], 0.0)
+            budget = cat['daily_budget'] or 0.0
+            spent = spent_by_category.get(cat['id'], 0.0)
             
             category_data = {
                 'category_id': cat['id'],
@@ -545,51 +494,48 @@ def delete_custom_category(category_id):
     try:
         user_id = get_current_user_id()
         
-        # Check if category exists and belongs to user
-        check_sql = '''
-            SELECT id, name, user_id 
-            FROM custom_categories 
-            WHERE id = %s AND user_id = %s
-        '''
-        category = run_query(check_sql, (category_id, user_id), fetch_one=True)
+        def delete(cur):
+            # Check if category exists and belongs to user (locked until the delete commits)
+            cur.execute('''
+                SELECT id, name, user_id 
+                FROM custom_categories 
+                WHERE id = %s AND user_id = %s
+                FOR UPDATE
+            ''', (category_id, user_id))
+            category = cur.fetchone()
+            if not category:
+                return None, 0, 0
+            
+            # Update expenses to remove category association (set to NULL)
+            cur.execute('''
+                UPDATE expenses 
+                SET category_id = NULL 
+                WHERE user_id = %s AND category_id = %s
+            ''', (user_id, f'custom_{category_id}'))
+            expense_count = cur.rowcount
+            
+            # Delete category budgets
+            cur.execute('''
+                DELETE FROM user_category_budgets 
+                WHERE user_id = %s AND category_id = %s AND category_type = 'custom'
+            ''', (user_id, category_id))
+            
+            # Delete the custom category
+            cur.execute('''
+                DELETE FROM custom_categories 
+                WHERE id = %s AND user_id = %s
+            ''', (category_id, user_id))
+            return category, expense_count, cur.rowcount
+        
+        # Unlinking expenses, dropping budgets and deleting the category succeed or fail together
+        category, expense_count, result = run_tx(delete)
         
         if not category:
             return jsonify({
                 'error': 'Custom category not found or you do not have permission to delete it',
                 'success': False
             }), 404
-        
-        # Check if category has any expenses
-        expenses_sql = '''
-            SELECT COUNT(*) as expense_count 
-            FROM expenses 
-            WHERE user_id = %s AND category_id = %s
-        '''
-        expenses_result = run_query(expenses_sql, (user_id, f'custom_{category_id}'), fetch_one=True)
-        expense_count = expenses_result['expense_count'] if expenses_result else 0
-        
-        # Update expenses to remove category association (set to NULL)
-        if expense_count > 0:
-            update_expenses_sql = '''
-                UPDATE expenses 
-                SET category_id = NULL 
-                WHERE user_id = %s AND category_id = %s
-            '''
-            run_query(update_expenses_sql, (user_id, f'custom_{category_id}'))
-        
-        # Delete category budgets
-        delete_budgets_sql = '''
-            DELETE FROM user_category_budgets 
-            WHERE user_id = %s AND category_id = %s AND category_type = 'custom'
-        '''
-        run_query(delete_budgets_sql, (user_id, category_id))
-        
-        # Delete the custom category
-        delete_category_sql = '''
-            DELETE FROM custom_categories 
-            WHERE id = %s AND user_id = %s
-        '''
-        result = run_query(delete_category_sql, (category_id, user_id), fetch_all=False)
+        _invalidate_categories_cache(user_id)
         
         if result:
             return jsonify({
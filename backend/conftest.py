@@ -4,7 +4,7 @@ import tempfile
 import psycopg2
 import psycopg2.extras
 from app import app
-from utils import get_db_connection
+from utils import db_connection, clear_cache
 from dotenv import load_dotenv
 
 # Load test environment variables
@@ -74,26 +74,27 @@ def setup_test_database():
 
 def cleanup_test_database():
     """Clean up test database after tests"""
+    # Ids are reused once sequences restart, so in-process caches must not outlive the data
+    clear_cache()
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Clear all test data from real tables
-        cur.execute("DELETE FROM expenses")
-        cur.execute("DELETE FROM categories")
-        cur.execute("DELETE FROM users")
-        
-        # Reset sequences if they exist
-        try:
-            cur.execute("ALTER SEQUENCE users_id_seq RESTART WITH 1")
-            cur.execute("ALTER SEQUENCE categories_id_seq RESTART WITH 1")
-            cur.execute("ALTER SEQUENCE expenses_id_seq RESTART WITH 1")
-        except:
-            pass  # Sequences might not exist or might be named differently
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            
+            # Clear all test data from real tables
+            cur.execute("DELETE FROM expenses")
+            cur.execute("DELETE FROM categories")
+            cur.execute("DELETE FROM users")
+            
+            # Reset sequences if they exist
+            try:
+                cur.execute("ALTER SEQUENCE users_id_seq RESTART WITH 1")
+                cur.execute("ALTER SEQUENCE categories_id_seq RESTART WITH 1")
+                cur.execute("ALTER SEQUENCE expenses_id_seq RESTART WITH 1")
+            except:
+                pass  # Sequences might not exist or might be named differently
+            
+            conn.commit()
+            cur.close()
         
     except Exception as e:
         print(f"Error cleaning up test database: {e}")
@@ -1,9 +1,11 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime, timezone
+from flask import Blueprint, Response, request, jsonify
+from datetime import datetime, timedelta, timezone
+import hashlib
 
 from utils import (
-    logger, run_query, validate_expense_data, handle_errors, 
-    get_day_bounds, get_expenses_between, get_user_daily_limit,
+    logger, run_query, run_prepared, iter_query, validate_expense_data, 
+    get_day_bounds, parse_day_offset, get_day_bounds_range, to_db_timestamp, get_expenses_between, get_user_daily_limit,
+    run_bulk_insert, json_response, get_cached_data, set_cached_data,
     ValidationError
 )
 from auth import require_auth, get_current_user_id
@@ -16,35 +18,126 @@ expenses_bp = Blueprint('expenses', __name__)
 def get_expenses():
     """Get expenses for a specific day"""
     # Get dayOffset from query string (?dayOffset=N), default to 0 (today)
-    day_offset = int(request.args.get('dayOffset', 0))
+    day_offset = parse_day_offset()
     user_id = get_current_user_id()
     start, end = get_day_bounds(day_offset, user_id)
+    params = (user_id, to_db_timestamp(start), to_db_timestamp(end))
+    
+    # A cheap aggregate over the day identifies its contents, so an unchanged day
+    # is answered with 304 before the rows are fetched or serialized
+    count, max_xmin = run_prepared('expenses_in_range_version', params, fetch_one=True, as_dict=False)
+    etag = hashlib.md5(f"{user_id}:{start.date()}:{count}:{max_xmin}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        rows = run_prepared('expenses_in_range', params, as_dict=False)
+        # Serialize straight from the row tuples; orjson renders timestamps like isoformat()
+        response = json_response([
+            {'id': r[0], 'amount': r[1], 'description': r[2], 'timestamp': r[3]}
+            for r in rows
+        ])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _require_categories(user_id):
+    """Return the user's require_categories preference (defaults to True)"""
+    result = run_prepared('user_require_categories', (user_id,), fetch_one=True)
+    return result['require_categories'] if result else True  # Default to True
+
+def _parse_category_id(user_id, category_id, require_categories):
+    """
+    Parse a submitted category_id without touching the database
+
+    Returns (category_type, numeric_id) or None when no category is given
+    and the user does not require categories.
+    """
+    # Validate category_id based on user preference
+    if require_categories and not category_id:
+        logger.warning("Category ID missing but categories are required", extra={
+            'user_id': user_id,
+            'require_categories': require_categories
+        })
+        raise ValidationError("Category is required", field="category_id")
+    elif not category_id:
+        logger.info("No category provided, expense will be saved without category", extra={
+            'user_id': user_id
+        })
+        return None
+    
+    # Parse category ID (format: "default_123" or "custom_456")
+    try:
+        if isinstance(category_id, str) and '_' in category_id:
+            category_type, cat_id = category_id.split('_', 1)
+            numeric_id = int(cat_id)
+        else:
+            # Legacy format - assume it's a custom category
+            numeric_id = int(category_id)
+            category_type = 'custom'
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid category", field="category_id")
+    # Anything that isn't a default category is looked up among the user's custom ones
+    return ('default' if category_type == 'default' else 'custom'), numeric_id
+
+def _category_exists_clause(category_type):
+    """SQL condition (params: id[, user_id]) that the parsed category exists for the user"""
+    if category_type == 'default':
+        return 'EXISTS (SELECT 1 FROM default_categories WHERE id = %s)'
+    return 'EXISTS (SELECT 1 FROM custom_categories WHERE id = %s AND user_id = %s)'
+
+def _category_exists_params(user_id, category_type, numeric_id):
+    if category_type == 'default':
+        return (numeric_id,)
+    return (numeric_id, user_id)
+
+def _existing_categories(user_id, parsed_categories):
+    """Return the subset of (category_type, numeric_id) pairs that exist for the user, in one query"""
+    default_ids = [numeric_id for category_type, numeric_id in parsed_categories if category_type == 'default']
+    custom_ids = [numeric_id for category_type, numeric_id in parsed_categories if category_type == 'custom']
     sql = '''
-        SELECT id, amount, description, timestamp 
-        FROM expenses 
-        WHERE user_id = %s AND timestamp >= %s AND timestamp < %s 
-        ORDER BY timestamp DESC
+        SELECT 'default' AS category_type, id FROM default_categories WHERE id = ANY(%s::int[])
+        UNION ALL
+        SELECT 'custom' AS category_type, id FROM custom_categories WHERE user_id = %s AND id = ANY(%s::int[])
     '''
-    raw_expenses = run_query(sql, (user_id, start.isoformat(), end.isoformat()))
+    return set(run_query(sql, (default_ids, user_id, custom_ids), as_dict=False))
+
+def _simulated_expense_timestamp(user_id):
+    """
+    Timestamp for a new expense when the user has a simulated date set
+
+    Returns None otherwise, in which case the expenses.timestamp column
+    default (current UTC time) applies.
+    """
+    # Check if user has a simulated date set (only if column exists)
+    from utils import _simulated_date_column_exists
+    if not _simulated_date_column_exists:
+        return None
     
-    # Convert data types for consistent API response
-    expenses = []
-    for e in raw_expenses:
-        expenses.append({
-            'id': e['id'],
-            'amount': float(e['amount']),
-            'description': e['description'],
-            'timestamp': e['timestamp'].isoformat() if hasattr(e['timestamp'], 'isoformat') else str(e['timestamp'])
-        })
+    simulated_date_result = run_query("""
+        SELECT simulated_date 
+        FROM user_preferences 
+        WHERE user_id = %s AND simulated_date IS NOT NULL
+    """, (user_id,), fetch_one=True)
+    
+    if not simulated_date_result or not simulated_date_result['simulated_date']:
+        return None
     
-    return jsonify(expenses)
+    # Use simulated date for the timestamp, with the current UTC time of day
+    simulated_date = simulated_date_result['simulated_date']
+    current_time = datetime.now(timezone.utc).time()
+    timestamp = datetime.combine(simulated_date, current_time).strftime('%Y-%m-%d %H:%M:%S')
+    logger.debug("Using simulated date for expense timestamp", extra={
+        'user_id': user_id,
+        'simulated_date': simulated_date,
+        'timestamp': timestamp
+    })
+    return timestamp
 
 @expenses_bp.route('/expenses', methods=['POST'])
 @require_auth
-@handle_errors
 def add_expense():
     """Add a new expense"""
-    logger.info("Add expense request received")
+    logger.debug("Add expense request received")
     
     if not request.is_json:
         raise ValidationError("Request must be JSON")
@@ -53,109 +146,20 @@ def add_expense():
     validated_data = validate_expense_data(data)
     amount = validated_data['amount']
     description = validated_data['description']
-    category_id = data.get('category_id')  # Category validation handled separately
     
     user_id = get_current_user_id()
     logger.debug("Processing expense for user", extra={'user_id': user_id})
     
     # Check user's category requirement preference
-    sql = 'SELECT require_categories FROM user_preferences WHERE user_id = %s'
-    result = run_query(sql, (user_id,), fetch_one=True)
-    require_categories = result['require_categories'] if result else True  # Default to True
+    require_categories = _require_categories(user_id)
     logger.debug("User category preference retrieved", extra={
         'user_id': user_id,
         'require_categories': require_categories
     })
+    parsed_category = _parse_category_id(user_id, data.get('category_id'), require_categories)
     
-    # Validate category_id based on user preference
-    if require_categories and not category_id:
-        logger.warning("Category ID missing but categories are required", extra={
-            'user_id': user_id,
-            'require_categories': require_categories
-        })
-        raise ValidationError("Category is required", field="category_id")
-    elif not require_categories and not category_id:
-        logger.info("Category ID missing but categories are optional, proceeding without category", extra={
-            'user_id': user_id
-        })
-        category_id = None
-    
-    # Initialize category_type
-    category_type = None
-    
-    # Validate category_id if provided
-    if category_id:
-        # Parse category ID (format: "default_123" or "custom_456")
-        if isinstance(category_id, str) and '_' in category_id:
-            category_type, cat_id = category_id.split('_', 1)
-            numeric_id = int(cat_id)
-        else:
-            # Legacy format - assume it's a custom category
-            numeric_id = int(category_id)
-            category_type = 'custom'
-        
-        logger.debug("Validating category", extra={
-            'user_id': user_id,
-            'category_type': category_type,
-            'numeric_id': numeric_id
-        })
-        
-        if category_type == 'default':
-            # Check if default category exists
-            check_sql = 'SELECT id FROM default_categories WHERE id = %s'
-            category_exists = run_query(check_sql, (numeric_id,), fetch_one=True)
-        else:
-            # Check if custom category exists and belongs to the user
-            check_sql = 'SELECT id FROM custom_categories WHERE id = %s AND user_id = %s'
-            category_exists = run_query(check_sql, (numeric_id, user_id), fetch_one=True)
-        
-        if not category_exists:
-            logger.warning("Invalid category provided", extra={
-                'user_id': user_id,
-                'category_type': category_type,
-                'numeric_id': numeric_id
-            })
-            raise ValidationError("Invalid category", field="category_id")
-        logger.debug("Category validated successfully", extra={
-            'user_id': user_id,
-            'category_type': category_type,
-            'numeric_id': numeric_id
-        })
-    else:
-        logger.info("No category provided, expense will be saved without category", extra={
-            'user_id': user_id
-        })
-    
-    # Use UTC timestamp to ensure consistent date handling across timezones
-    # Check if user has a simulated date set (only if column exists)
-    from utils import _simulated_date_column_exists
-    simulated_date_result = None
-    
-    if _simulated_date_column_exists:
-        simulated_date_result = run_query("""
-            SELECT simulated_date 
-            FROM user_preferences 
-            WHERE user_id = %s AND simulated_date IS NOT NULL
-        """, (user_id,), fetch_one=True)
-    
-    if simulated_date_result and simulated_date_result['simulated_date']:
-        # Use simulated date for the timestamp
-        simulated_date = simulated_date_result['simulated_date']
-        # Create timestamp with simulated date but current time
-        current_time = datetime.now(timezone.utc).time()
-        timestamp = datetime.combine(simulated_date, current_time).strftime('%Y-%m-%d %H:%M:%S')
-        logger.debug("Using simulated date for expense timestamp", extra={
-            'user_id': user_id,
-            'simulated_date': simulated_date,
-            'timestamp': timestamp
-        })
-    else:
-        # Use current UTC timestamp
-        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        logger.debug("Using current UTC timestamp for expense", extra={
-            'user_id': user_id,
-            'timestamp': timestamp
-        })
+    # Timestamps are stored in UTC; the column default supplies "now" unless a date is simulated
+    timestamp = _simulated_expense_timestamp(user_id)
     
     logger.info("Inserting expense into database", extra={
         'user_id': user_id,
@@ -163,126 +167,186 @@ def add_expense():
         'description': description
     })
     
-    # Convert category_id back to the full string format for storage
-    if category_id:
-        if category_type == 'default':
-            storage_category_id = f"default_{numeric_id}"
-        else:
-            storage_category_id = f"custom_{numeric_id}"
+    columns = ['user_id', 'amount', 'description', 'category_id']
+    if parsed_category:
+        category_type, numeric_id = parsed_category
+        storage_category_id = f"{category_type}_{numeric_id}"
     else:
         storage_category_id = None
+    params = [user_id, amount, description, storage_category_id]
+    if timestamp:
+        columns.append('timestamp')
+        params.append(timestamp)
+    placeholders = ', '.join(['%s'] * len(columns))
     
-    sql = '''
-        INSERT INTO expenses (user_id, amount, description, category_id, timestamp)
-        VALUES (%s, %s, %s, %s, %s)
-    '''
-    result = run_query(sql, (user_id, amount, description, storage_category_id, timestamp), fetch_all=False)
+    # The category existence check rides along with the INSERT, so a bad
+    # category simply inserts nothing instead of costing a separate round trip
+    if parsed_category:
+        sql = f'''
+            INSERT INTO expenses ({', '.join(columns)})
+            SELECT {placeholders}
+            WHERE {_category_exists_clause(category_type)}
+            RETURNING id, timestamp
+        '''
+        params.extend(_category_exists_params(user_id, category_type, numeric_id))
+    else:
+        sql = f'''
+            INSERT INTO expenses ({', '.join(columns)})
+            VALUES ({placeholders})
+            RETURNING id, timestamp
+        '''
+    result = run_query(sql, tuple(params), fetch_one=True, write=True)
+    if not result:
+        logger.warning("Invalid category provided", extra={
+            'user_id': user_id,
+            'category_id': storage_category_id
+        })
+        raise ValidationError("Invalid category", field="category_id")
     logger.info("Expense inserted successfully", extra={
         'user_id': user_id,
-        'expense_id': result,
+        'expense_id': result['id'],
         'category_id': storage_category_id,
         'amount': amount
     })
-    return jsonify({'success': True}), 201
+    # Return the stored row so clients don't need to refetch it
+    return json_response({
+        'success': True,
+        'expense': {
+            'id': result['id'],
+            'amount': amount,
+            'description': description,
+            'category_id': storage_category_id,
+            'timestamp': result['timestamp']
+        }
+    }, status=201)
+
+# Upper bound on expenses accepted by one bulk request
+MAX_BULK_EXPENSES = 1000
+
+@expenses_bp.route('/expenses/bulk', methods=['POST'])
+@require_auth
+def add_expenses_bulk():
+    """Add many expenses in one request, inserted in a single transaction"""
+    if not request.is_json:
+        raise ValidationError("Request must be JSON")
+    
+    data = request.get_json()
+    items = data.get('expenses') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValidationError("A non-empty list of expenses is required", field="expenses")
+    if len(items) > MAX_BULK_EXPENSES:
+        raise ValidationError(f"Too many expenses (max {MAX_BULK_EXPENSES})", field="expenses")
+    
+    user_id = get_current_user_id()
+    require_categories = _require_categories(user_id)
+    timestamp = _simulated_expense_timestamp(user_id)
+    
+    # Validate everything up front so the batch is all-or-nothing
+    parsed_items = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValidationError("Each expense must be an object", field="expenses")
+        validated_data = validate_expense_data(item)
+        parsed_items.append((validated_data, _parse_category_id(user_id, item.get('category_id'), require_categories)))
+    
+    # Check every referenced category with a single set-based lookup
+    parsed_categories = {parsed for _, parsed in parsed_items if parsed}
+    if parsed_categories:
+        missing = parsed_categories - _existing_categories(user_id, parsed_categories)
+        if missing:
+            logger.warning("Invalid category provided", extra={
+                'user_id': user_id,
+                'categories': sorted(f"{category_type}_{numeric_id}" for category_type, numeric_id in missing)
+            })
+            raise ValidationError("Invalid category", field="category_id")
+    
+    rows = []
+    for validated_data, parsed in parsed_items:
+        storage_category_id = f"{parsed[0]}_{parsed[1]}" if parsed else None
+        row = (user_id, validated_data['amount'], validated_data['description'], storage_category_id)
+        rows.append(row + (timestamp,) if timestamp else row)
+    
+    # Without a simulated date the column default stamps every row with the current UTC time
+    inserted = run_bulk_insert(
+        'INSERT INTO expenses (user_id, amount, description, category_id, timestamp) VALUES %s',
+        rows,
+        template='(%s, %s, %s, %s, %s)' if timestamp else '(%s, %s, %s, %s, DEFAULT)'
+    )
+    logger.info("Bulk expenses inserted successfully", extra={
+        'user_id': user_id,
+        'count': inserted
+    })
+    return jsonify({'success': True, 'inserted': inserted}), 201
 
 @expenses_bp.route('/summary', methods=['GET'])
 @require_auth
 def get_summary():
     """Get spending summary and plant state"""
-    try:
-        day_offset = int(request.args.get('dayOffset', 0))
-        user_id = get_current_user_id()
-        today_start, today_end = get_day_bounds(day_offset, user_id)
-        
-        # Get user's daily limit with fallback
-        try:
-            user_daily_limit = get_user_daily_limit(user_id)
-        except Exception as e:
-            logger.error(f"Error getting user daily limit: {e}, using default")
-            user_daily_limit = 30.0
-        
-        # OPTIMIZED: Get 7-day spending data in a single query
-        start_date, _ = get_day_bounds(day_offset - 6, user_id)  # 7 days ago
-        _, end_date = get_day_bounds(day_offset + 1, user_id)    # Tomorrow
-        
-        try:
-            # Single query to get daily spending for the last 7 days
-            summary_sql = '''
-                SELECT 
-                    DATE(timestamp) as date,
-                    SUM(amount) as daily_total
-                FROM expenses 
-                WHERE user_id = %s 
-                AND timestamp >= %s 
-                AND timestamp < %s
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-            '''
-            
-            daily_spending = run_query(summary_sql, (user_id, start_date.isoformat(), end_date.isoformat()), fetch_all=True)
-            
-            # Create a lookup for daily spending
-            spending_lookup = {}
-            for day in daily_spending:
-                spending_lookup[day['date'].strftime('%Y-%m-%d')] = float(day['daily_total'])
-            
-            # Calculate daily surplus for the last 7 days
-            deltas = []
-            for i in range(7):
-                offset = day_offset - i
-                day_start, day_end = get_day_bounds(offset, user_id)
-                date_key = day_start.strftime('%Y-%m-%d')
-                daily_spent = spending_lookup.get(date_key, 0.0)
-                daily_surplus = user_daily_limit - daily_spent
-                deltas.append(daily_surplus)
-                
-        except Exception as e:
-            logger.error(f"Error getting 7-day spending data: {e}, using defaults")
-            # Fallback to default values
-            deltas = [user_daily_limit] * 7
-        
-        # Today's balance and averages
-        today_balance = deltas[0] if deltas else user_daily_limit
-        avg_daily_surplus = sum(deltas) / 7 if deltas else user_daily_limit  # Always divide by 7 days
-        
-        # Plant state logic - prioritize today's spending over 7-day average
-        if today_balance < 0:
-            # Today's spending exceeded the daily limit
-            if today_balance >= -5:
-                plant = 'wilting'
-                plant_emoji = '🥀'
-            else:
-                plant = 'dead'
-                plant_emoji = '☠️'
-        elif today_balance >= 10 and avg_daily_surplus >= 2:
-            plant = 'thriving'
-            plant_emoji = '🌳'
-        elif today_balance >= 0 and avg_daily_surplus >= -2:
-            plant = 'healthy'
-            plant_emoji = '🌱'
+    day_offset = parse_day_offset()
+    user_id = get_current_user_id()
+    
+    today_start, today_end = get_day_bounds(day_offset, user_id)
+    
+    # OPTIMIZED: Read 7-day spending from the trigger-maintained daily totals, with
+    # the daily limit riding along on every row so both arrive in one round trip.
+    # The window is derived from today's bounds so the simulated-date lookup runs only once.
+    # Database errors (e.g. a missing rollup table) surface as errors rather than
+    # being papered over with default numbers.
+    start_date = today_start - timedelta(days=6)  # 7 days ago
+    
+    # generate_series supplies all 7 days (zero-filled), newest first
+    summary_sql = '''
+        SELECT (SELECT daily_spending_limit FROM user_preferences WHERE user_id = %s),
+               COALESCE(t.total, 0)
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') AS d(day)
+        LEFT JOIN expense_daily_totals t
+            ON t.user_id = %s AND t.day = d.day::date
+        ORDER BY d.day DESC
+    '''
+    
+    rows = run_query(summary_sql, (user_id, start_date.date(), today_start.date(), user_id), as_dict=False)
+    
+    user_daily_limit = rows[0][0]
+    if user_daily_limit is None:
+        # No preferences yet; this creates them with the default limit
+        user_daily_limit = get_user_daily_limit(user_id)
+    
+    # Daily surplus for the last 7 days, newest first
+    deltas = [user_daily_limit - spent for _, spent in rows]
+    
+    # Today's balance and averages
+    today_balance = deltas[0] if deltas else user_daily_limit
+    avg_daily_surplus = sum(deltas) / 7 if deltas else user_daily_limit  # Always divide by 7 days
+    
+    # Plant state logic - prioritize today's spending over 7-day average
+    if today_balance < 0:
+        # Today's spending exceeded the daily limit
+        if today_balance >= -5:
+            plant = 'wilting'
+            plant_emoji = '🥀'
         else:
-            plant = 'struggling'
-            plant_emoji = '🌿'
-        
-        return jsonify({
-            'balance': round(today_balance, 2),
-            'avg_7day': round(avg_daily_surplus, 2),
-            'daily_limit': user_daily_limit,
-            'plant_state': plant,
-            'plant_emoji': plant_emoji
-        })
-        
-    except Exception as e:
-        logger.error(f"Summary endpoint error: {e}")
-        
-        # Return a safe fallback response instead of crashing
-        return jsonify({
-            'balance': 30.0,
-            'avg_7day': 30.0,
-            'daily_limit': 30.0,
-            'plant_state': 'healthy',
-            'plant_emoji': '🌱'
-        })
+            plant = 'dead'
+            plant_emoji = '☠️'
+    elif today_balance >= 10 and avg_daily_surplus >= 2:
+        plant = 'thriving'
+        plant_emoji = '🌳'
+    elif today_balance >= 0 and avg_daily_surplus >= -2:
+        plant = 'healthy'
+        plant_emoji = '🌱'
+    else:
+        plant = 'struggling'
+        plant_emoji = '🌿'
+    
+    return json_response({
+        'balance': round(today_balance, 2),
+        'avg_7day': round(avg_daily_surplus, 2),
+        'daily_limit': user_daily_limit,
+        'plant_state': plant,
+        'plant_emoji': plant_emoji
+    })
+
+# Longest window /history will return in one response (the UI offers up to 6 months)
+MAX_HISTORY_DAYS = 366
 
 @expenses_bp.route('/history', methods=['GET'])
 @require_auth
@@ -290,47 +354,55 @@ def get_history():
     """Get expense history grouped by date"""
     try:
         # Get all expenses from the last 7 days (including today)
-        day_offset = int(request.args.get('dayOffset', 0))
-        period = int(request.args.get('period', 7))  # Default to 7 days
+        day_offset = parse_day_offset()
+        # Default to 7 days; the window bounds the work instead of a count + LIMIT
+        period = max(1, min(MAX_HISTORY_DAYS, request.args.get('period', 7, type=int)))
         category_id = request.args.get('category_id')  # Optional category filter
         
         user_id = get_current_user_id()
-        start_date, _ = get_day_bounds(day_offset - (period - 1), user_id)
-        _, end_date = get_day_bounds(day_offset, user_id)
+        start_date, end_date = get_day_bounds_range(day_offset, period, user_id)
+        
+        # Group by date (YYYY-MM-DD) and build the whole response document in SQL;
+        # json_build_object renders timestamps in the same ISO format as isoformat()
+        category_filter = 'AND e.category_id = %s' if category_id else ''
+        sql = f'''
+            SELECT COALESCE(json_agg(json_build_object('date', days.date, 'expenses', days.expenses)
+                                     ORDER BY days.date DESC), '[]')::text
+            FROM (
+                SELECT to_char(e.timestamp, 'YYYY-MM-DD') AS date,
+                       json_agg(json_build_object(
+                           'id', e.id,
+                           'amount', e.amount::float8,
+                           'description', e.description,
+                           'timestamp', e.timestamp,
+                           'category', CASE WHEN COALESCE(dc.name, cc.name) IS NOT NULL THEN json_build_object(
+                               'id', e.category_ref_id::text,
+                               'name', COALESCE(dc.name, cc.name),
+                               'icon', COALESCE(dc.icon, cc.icon),
+                               'color', COALESCE(dc.color, cc.color),
+                               'is_default', e.category_type = 0
+                           ) END
+                       ) ORDER BY e.timestamp DESC) AS expenses
+                FROM expenses e
+                LEFT JOIN default_categories dc ON e.category_type = 0 AND dc.id = e.category_ref_id
+                LEFT JOIN custom_categories cc ON e.category_type = 1 AND cc.id = e.category_ref_id AND cc.user_id = e.user_id
+                WHERE e.user_id = %s AND e.timestamp >= %s AND e.timestamp < %s {category_filter}
+                GROUP BY 1
+            ) days
+        '''
+        params = (user_id, to_db_timestamp(start_date), to_db_timestamp(end_date))
+        if category_id:
+            params += (category_id,)
         
         try:
-            expenses = get_expenses_between(start_date, end_date, user_id, category_id)
+            # Cast to text so psycopg2 hands back the document instead of parsing it into dicts
+            body = run_query(sql, params, fetch_one=True, as_dict=False)[0]
         except Exception as e:
             logger.error(f"Error getting expenses: {e}")
             # Return empty history instead of crashing
             return jsonify([])
         
-        # Group by date (YYYY-MM-DD)
-        grouped = {}
-        for e in expenses:
-            date = e['timestamp'][:10]  # 'YYYY-MM-DD' (timestamp is already a string from helper)
-            if date not in grouped:
-                grouped[date] = []
-            expense_data = {
-                'id': e['id'],  # Add the expense ID for edit/delete functionality
-                'amount': e['amount'],  # Already converted to float in helper
-                'description': e['description'],
-                'timestamp': e['timestamp']  # Already converted to string in helper
-            }
-            
-            # Add category information if present
-            if e.get('category'):
-                expense_data['category'] = e['category']
-            else:
-                expense_data['category'] = None
-                
-            grouped[date].append(expense_data)
-        # Sort by date descending
-        grouped_sorted = [
-            {'date': date, 'expenses': grouped[date]}
-            for date in sorted(grouped.keys(), reverse=True)
-        ]
-        return jsonify(grouped_sorted)
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
         logger.error(f"History endpoint error: {e}")
@@ -339,10 +411,9 @@ def get_history():
 
 @expenses_bp.route('/expenses/<int:expense_id>', methods=['PUT', 'POST'])
 @require_auth
-@handle_errors
 def update_expense(expense_id):
     """Update an existing expense"""
-    logger.info(f"Update expense request received for expense {expense_id}")
+    logger.debug("Update expense request received for expense %s", expense_id)
     
     if not request.is_json:
         raise ValidationError("Request must be JSON")
@@ -411,7 +482,7 @@ def update_expense(expense_id):
         
         logger.debug(f"Executing update SQL with params: amount={amount}, description={description}, category_id={storage_category_id}, expense_id={expense_id}, user_id={user_id}")
         
-        result = run_query(update_sql, (amount, description, storage_category_id, expense_id, user_id), fetch_all=False)
+        result = run_query(update_sql, (amount, description, storage_category_id, expense_id, user_id), fetch_all=False, write=True)
         
         logger.debug(f"Update result: {result}")
         
@@ -428,10 +499,9 @@ def update_expense(expense_id):
 
 @expenses_bp.route('/expenses/<int:expense_id>', methods=['DELETE'])
 @require_auth
-@handle_errors
 def delete_expense(expense_id):
     """Delete an existing expense"""
-    logger.info(f"Delete expense request received for expense {expense_id}")
+    logger.debug("Delete expense request received for expense %s", expense_id)
     
     user_id = get_current_user_id()
     logger.debug(f"Processing expense deletion for user {user_id}, expense {expense_id}")
@@ -446,7 +516,7 @@ def delete_expense(expense_id):
     
     # Delete the expense
     delete_sql = 'DELETE FROM expenses WHERE id = %s AND user_id = %s'
-    result = run_query(delete_sql, (expense_id, user_id), fetch_all=False)
+    result = run_query(delete_sql, (expense_id, user_id), fetch_all=False, write=True)
     
     if result == 0:
         logger.error(f"No rows deleted for expense {expense_id}")
@@ -457,27 +527,20 @@ def delete_expense(expense_id):
 
 @expenses_bp.route('/analytics/daily-spending', methods=['GET'])
 @require_auth
-@handle_errors
 def get_daily_spending_analytics():
     """Get daily spending analytics - ultra-fast version"""
     try:
         user_id = get_current_user_id()
         days = int(request.args.get('days', 30))
-        day_offset = int(request.args.get('dayOffset', 0))
+        day_offset = parse_day_offset()
         
         # Simple cache for daily spending
-        from datetime import datetime
-        cache_key = f"daily_{user_id}_{days}_{day_offset}"
-        if not hasattr(get_daily_spending_analytics, '_cache'):
-            get_daily_spending_analytics._cache = {}
-        
-        cache = get_daily_spending_analytics._cache
-        # Re-enable caching to reduce server load
-        if cache_key in cache:
-            cache_time, cached_data = cache[cache_key]
-            if (datetime.now() - cache_time).total_seconds() < 60:  # 1 minute cache
-                logger.info(f"Daily spending cache hit for user {user_id}")
-                return jsonify(cached_data)
+        cache_key = f"analytics_daily_{user_id}_{days}_{day_offset}"
+        # Re-enable caching to reduce server load (1 minute cache)
+        cached_data = get_cached_data(cache_key, max_age_seconds=60)
+        if cached_data is not None:
+            logger.debug("Daily spending cache hit for user %s", user_id)
+            return jsonify(cached_data)
         
         # Validate inputs
         if days <= 0 or days > 365:
@@ -527,13 +590,13 @@ def get_daily_spending_analytics():
         else:
             today = datetime.now(timezone.utc).date() + timedelta(days=day_offset)
         
-        logger.info(f"Analytics date calculation: day_offset={day_offset}, today={today}")
+        logger.debug("Analytics date calculation: day_offset=%s, today=%s", day_offset, today)
         
         # Use the properly calculated today date
         start_date = today - timedelta(days=days-1)
         end_date = today + timedelta(days=1)  # Include the end day
         
-        logger.info(f"Date calculation: start={start_date}, end={end_date} for {days} days")
+        logger.debug("Date calculation: start=%s, end=%s for %s days", start_date, end_date, days)
         
         # Ultra-simple direct query - no helper functions that can fail
         sql = '''
@@ -548,54 +611,47 @@ def get_daily_spending_analytics():
             ORDER BY timestamp ASC
         '''
         
+        # Stream the rows and group them by date in a single pass instead of
+        # materializing every expense in the range first
+        daily_totals = {}
+        expense_count = 0
         try:
-            all_expenses = run_query(sql, (user_id, start_date.isoformat(), end_date.isoformat()))
-            logger.info(f"Successfully fetched {len(all_expenses)} expenses for daily spending analytics")
+            rows = iter_query(sql, (user_id, to_db_timestamp(start_date), to_db_timestamp(end_date)), as_dict=False)
+            for amount, description, timestamp in rows:
+                expense_count += 1
+                try:
+                    # Handle direct query data structure (datetime object)
+                    expense_timestamp = timestamp
+                    # Ensure we're using the same timezone as our date calculation
+                    if expense_timestamp.tzinfo is None:
+                        # If no timezone info, assume UTC
+                        expense_timestamp = expense_timestamp.replace(tzinfo=timezone.utc)
+                    expense_date = expense_timestamp.date()
+                except Exception as e:
+                    logger.warning(f"Could not parse timestamp {timestamp}: {e}")
+                    # Fallback: use the start_date
+                    expense_date = start_date
+                
+                date_str = expense_date.strftime('%Y-%m-%d')
+                logger.debug("Processing expense: date=%s, amount=%s, timestamp=%s", date_str, amount, timestamp)
+                if date_str not in daily_totals:
+                    daily_totals[date_str] = {
+                        'amount': 0.0,
+                        'count': 0,
+                        'expenses': []
+                    }
+                daily_totals[date_str]['amount'] += amount
+                daily_totals[date_str]['count'] += 1
+                daily_totals[date_str]['expenses'].append({
+                    'amount': amount,
+                    'description': description,
+                    'time': timestamp.strftime('%H:%M')
+                })
         except Exception as e:
             logger.error(f"Direct query failed: {e}")
             raise
         
-        # Add date information to each expense based on timestamp
-        for expense in all_expenses:
-            try:
-                # Handle direct query data structure (datetime object)
-                expense_timestamp = expense['timestamp']
-                # Ensure we're using the same timezone as our date calculation
-                if expense_timestamp.tzinfo is None:
-                    # If no timezone info, assume UTC
-                    expense_timestamp = expense_timestamp.replace(tzinfo=timezone.utc)
-                expense['expense_date'] = expense_timestamp.date()
-            except Exception as e:
-                logger.warning(f"Could not parse timestamp {expense['timestamp']}: {e}")
-                # Fallback: use the start_date
-                expense['expense_date'] = start_date
-        
-        logger.info(f"Analytics query: start_date={start_date}, end_date={end_date}, found {len(all_expenses)} expenses")
-        
-        # Log some sample expenses for debugging
-        if all_expenses:
-            logger.info(f"Sample expenses: {all_expenses[:3]}")
-        else:
-            logger.info("No expenses found in date range")
-        
-        # Group expenses by date
-        daily_totals = {}
-        for expense in all_expenses:
-            date_str = expense['expense_date'].strftime('%Y-%m-%d')
-            logger.info(f"Processing expense: date={date_str}, amount={expense['amount']}, timestamp={expense['timestamp']}")
-            if date_str not in daily_totals:
-                daily_totals[date_str] = {
-                    'amount': 0.0,
-                    'count': 0,
-                    'expenses': []
-                }
-            daily_totals[date_str]['amount'] += float(expense['amount'])
-            daily_totals[date_str]['count'] += 1
-            daily_totals[date_str]['expenses'].append({
-                'amount': float(expense['amount']),
-                'description': expense['description'],
-                'time': expense['timestamp'].strftime('%H:%M')
-            })
+        logger.debug("Analytics query: start_date=%s, end_date=%s, found %s expenses", start_date, end_date, expense_count)
         
         # Create complete date range with data
         chart_data = []
@@ -650,7 +706,7 @@ def get_daily_spending_analytics():
         }
         
         # Cache the response
-        cache[cache_key] = (datetime.now(), response_data)
+        set_cached_data(cache_key, response_data)
         
         return jsonify(response_data)
         
@@ -664,27 +720,20 @@ def get_daily_spending_analytics():
 
 @expenses_bp.route('/analytics/category-breakdown', methods=['GET'])
 @require_auth
-@handle_errors
 def get_category_breakdown_analytics():
     """Get category spending breakdown analytics - cached version"""
     try:
         user_id = get_current_user_id()
         days = int(request.args.get('days', 30))
-        day_offset = int(request.args.get('dayOffset', 0))
+        day_offset = parse_day_offset()
         
         # Simple cache for category breakdown
-        from datetime import datetime
-        cache_key = f"category_{user_id}_{days}_{day_offset}"
-        if not hasattr(get_category_breakdown_analytics, '_cache'):
-            get_category_breakdown_analytics._cache = {}
-        
-        cache = get_category_breakdown_analytics._cache
-        # Re-enable caching to reduce server load
-        if cache_key in cache:
-            cache_time, cached_data = cache[cache_key]
-            if (datetime.now() - cache_time).total_seconds() < 60:  # 1 minute cache
-                logger.info(f"Category breakdown cache hit for user {user_id}")
-                return jsonify(cached_data)
+        cache_key = f"analytics_category_{user_id}_{days}_{day_offset}"
+        # Re-enable caching to reduce server load (1 minute cache)
+        cached_data = get_cached_data(cache_key, max_age_seconds=60)
+        if cached_data is not None:
+            logger.debug("Category breakdown cache hit for user %s", user_id)
+            return jsonify(cached_data)
         
         # Use the same date calculation logic as daily spending analytics
         from datetime import datetime, timedelta, timezone
@@ -701,7 +750,7 @@ def get_category_breakdown_analytics():
         start_date = target_date - timedelta(days=days - 1)
         end_date = target_date + timedelta(days=1)  # Include the end day
         
-        logger.info(f"Category analytics ultra-simple date calculation: start={start_date}, end={end_date} for {days} days")
+        logger.debug("Category analytics ultra-simple date calculation: start=%s, end=%s for %s days", start_date, end_date, days)
         
         # Ultra-simple direct query with category information - no helper functions
         sql = '''
@@ -712,59 +761,52 @@ def get_category_breakdown_analytics():
                 COALESCE(dc.name, cc.name) as category_name,
                 COALESCE(dc.color, cc.color) as category_color
             FROM expenses e
-            LEFT JOIN default_categories dc ON e.category_id = CONCAT('default_', dc.id::text)
-            LEFT JOIN custom_categories cc ON e.category_id = CONCAT('custom_', cc.id::text) AND cc.user_id = e.user_id
+            LEFT JOIN default_categories dc ON e.category_type = 0 AND dc.id = e.category_ref_id
+            LEFT JOIN custom_categories cc ON e.category_type = 1 AND cc.id = e.category_ref_id AND cc.user_id = e.user_id
             WHERE e.user_id = %s
                 AND e.timestamp >= %s
                 AND e.timestamp < %s
             ORDER BY e.timestamp ASC
         '''
         
+        # Group expenses by category in one pass over plain row tuples
+        category_totals = {}
+        total_spent = 0.0
+        expense_count = 0
+        
         try:
-            all_expenses = run_query(sql, (user_id, start_date.isoformat(), end_date.isoformat()))
-            logger.info(f"Successfully fetched {len(all_expenses)} expenses for category breakdown analytics")
+            rows = iter_query(sql, (user_id, to_db_timestamp(start_date), to_db_timestamp(end_date)), as_dict=False)
+            for amount, description, timestamp, category_name, category_color in rows:
+                expense_count += 1
+                try:
+                    expense_date = timestamp.date()
+                except Exception as e:
+                    logger.warning(f"Could not parse timestamp {timestamp}: {e}")
+                    # Fallback: use the start_date
+                    expense_date = start_date
+                
+                category_name = category_name or 'Uncategorized'
+                if category_name not in category_totals:
+                    category_totals[category_name] = {
+                        'amount': 0.0,
+                        'count': 0,
+                        'color': category_color or '#6c757d',
+                        'expenses': []
+                    }
+                
+                category_totals[category_name]['amount'] += amount
+                category_totals[category_name]['count'] += 1
+                category_totals[category_name]['expenses'].append({
+                    'amount': amount,
+                    'description': description,
+                    'date': expense_date.strftime('%Y-%m-%d'),
+                    'time': timestamp.strftime('%H:%M')
+                })
+                total_spent += amount
         except Exception as e:
             logger.error(f"Category analytics direct query failed: {e}")
             raise
-        
-        # Add date information to each expense based on timestamp
-        for expense in all_expenses:
-            try:
-                # Handle direct query data structure (datetime object)
-                expense_timestamp = expense['timestamp']
-                expense['expense_date'] = expense_timestamp.date()
-            except Exception as e:
-                logger.warning(f"Could not parse timestamp {expense['timestamp']}: {e}")
-                # Fallback: use the start_date
-                expense['expense_date'] = start_date
-        
-        # Group expenses by category
-        category_totals = {}
-        total_spent = 0.0
-        
-        for expense in all_expenses:
-            # Handle direct query data structure
-            category_name = expense.get('category_name') or 'Uncategorized'
-            category_color = expense.get('category_color') or '#6c757d'
-            amount = float(expense['amount'])
-            
-            if category_name not in category_totals:
-                category_totals[category_name] = {
-                    'amount': 0.0,
-                    'count': 0,
-                    'color': category_color,
-                    'expenses': []
-                }
-            
-            category_totals[category_name]['amount'] += amount
-            category_totals[category_name]['count'] += 1
-            category_totals[category_name]['expenses'].append({
-                'amount': amount,
-                'description': expense['description'],
-                'date': expense['expense_date'].strftime('%Y-%m-%d'),
-                'time': expense['timestamp'].strftime('%H:%M')
-            })
-            total_spent += amount
+        logger.debug("Successfully fetched %s expenses for category breakdown analytics", expense_count)
         
         # Convert to chart data format
         chart_data = []
@@ -793,7 +835,7 @@ def get_category_breakdown_analytics():
         }
         
         # Cache the response
-        cache[cache_key] = (datetime.now(), response_data)
+        set_cached_data(cache_key, response_data)
         
         return jsonify(response_data)
         
@@ -807,33 +849,26 @@ def get_category_breakdown_analytics():
 
 @expenses_bp.route('/analytics/weekly-heatmap', methods=['GET'])
 @require_auth
-@handle_errors
 def get_weekly_heatmap_analytics():
     """Get 30-day spending heatmap analytics - ultra-optimized version"""
     try:
         user_id = get_current_user_id()
         days = int(request.args.get('days', 30))  # Default to 30 days
-        day_offset = int(request.args.get('dayOffset', 0))
+        day_offset = parse_day_offset()
         
         # Simple in-memory cache for instant responses
-        cache_key = f"heatmap_{user_id}_{days}_{day_offset}"
+        cache_key = f"analytics_heatmap_{user_id}_{days}_{day_offset}"
         
         # Check if we have cached data (2 minute cache)
         from datetime import datetime, timedelta, timezone
-        if not hasattr(get_weekly_heatmap_analytics, '_cache'):
-            get_weekly_heatmap_analytics._cache = {}
-        
-        cache = get_weekly_heatmap_analytics._cache
-        # Re-enable caching to reduce server load
-        if cache_key in cache:
-            cache_time, cached_data = cache[cache_key]
-            if (datetime.now() - cache_time).total_seconds() < 120:  # 2 minute cache
-                logger.info(f"Heatmap cache hit for user {user_id}")
-                return jsonify(cached_data)
+        cached_data = get_cached_data(cache_key, max_age_seconds=120)
+        if cached_data is not None:
+            logger.debug("Heatmap cache hit for user %s", user_id)
+            return jsonify(cached_data)
         
         # Performance tracking
         start_time = datetime.now()
-        logger.info(f"Heatmap request started for user {user_id}, days={days}, offset={day_offset}")
+        logger.debug("Heatmap request started for user %s, days=%s, offset=%s", user_id, days, day_offset)
         
         # Use the same date calculation logic as other analytics
         from datetime import datetime, timedelta, timezone
@@ -845,29 +880,30 @@ def get_weekly_heatmap_analytics():
         start_date_for_range = today_for_range - timedelta(days=days-1)
         
         # ULTRA-MINIMAL: Single query with minimal processing
-        overall_start, _ = get_day_bounds(day_offset - (days-1), user_id)
-        _, overall_end = get_day_bounds(day_offset + 1, user_id)
+        overall_start, overall_end = get_day_bounds_range(day_offset + 1, days + 1, user_id)
         
-        # Minimal query - just get daily totals
+        # Minimal query - daily totals come straight from the trigger-maintained rollup.
+        # The trigger only decrements, so days whose expenses were all deleted or moved
+        # linger as zero-count rows; skip them so they don't count as spending days
         sql = '''
             SELECT
-                DATE(timestamp) as expense_date,
-                SUM(amount) as daily_total,
-                COUNT(*) as transaction_count
-            FROM expenses
+                day as expense_date,
+                total as daily_total,
+                expense_count as transaction_count
+            FROM expense_daily_totals
             WHERE user_id = %s
-                AND timestamp >= %s
-                AND timestamp < %s
-            GROUP BY DATE(timestamp)
+                AND day >= %s
+                AND day < %s
+                AND expense_count > 0
         '''
         
-        daily_data = run_query(sql, (user_id, overall_start.isoformat(), overall_end.isoformat()))
+        daily_data = run_query(sql, (user_id, overall_start.date(), overall_end.date()))
         
         # Create simple lookup - just amounts
         daily_amounts = {}
         for day in daily_data:
             date_str = day['expense_date'].strftime('%Y-%m-%d')
-            daily_amounts[date_str] = float(day['daily_total'])
+            daily_amounts[date_str] = day['daily_total']
         
         # Find max spending for color scaling
         max_spending = max(daily_amounts.values()) if daily_amounts else 0
@@ -936,7 +972,7 @@ def get_weekly_heatmap_analytics():
         # Performance tracking
         end_time = datetime.now()
         processing_time = (end_time - start_time).total_seconds()
-        logger.info(f"Heatmap request completed in {processing_time:.2f} seconds for user {user_id}")
+        logger.debug("Heatmap request completed in %.2f seconds for user %s", processing_time, user_id)
         
         # Calculate avg spending
         avg_spending = sum(daily_amounts.values()) / len(daily_amounts) if daily_amounts else 0
@@ -956,7 +992,7 @@ def get_weekly_heatmap_analytics():
         }
         
         # Cache the response
-        cache[cache_key] = (datetime.now(), response_data)
+        set_cached_data(cache_key, response_data)
         
         return jsonify(response_data)
         
@@ -970,20 +1006,20 @@ def get_weekly_heatmap_analytics():
 
 @expenses_bp.route('/analytics/compare-history', methods=['GET'])
 @require_auth
-@handle_errors
 def compare_analytics_history():
     """Compare analytics and history data to debug differences"""
     try:
         user_id = get_current_user_id()
         days = int(request.args.get('days', 30))
-        day_offset = int(request.args.get('dayOffset', 0))
+        day_offset = parse_day_offset()
         
         logger.info(f"Comparing analytics vs history for user {user_id}, days={days}, offset={day_offset}")
         
+        # Both data sets cover the same days, so resolve the bounds once
+        start_date, end_date = get_day_bounds_range(day_offset, days, user_id)
+        
         # Get history data
         try:
-            start_date, _ = get_day_bounds(day_offset - (days - 1), user_id)
-            _, end_date = get_day_bounds(day_offset, user_id)
             history_expenses = get_expenses_between(start_date, end_date, user_id)
         except Exception as e:
             logger.error(f"History data fetch failed: {e}")
@@ -991,9 +1027,7 @@ def compare_analytics_history():
         
         # Get analytics data (same logic as daily spending analytics)
         try:
-            analytics_start, _ = get_day_bounds(day_offset - (days - 1), user_id)
-            _, analytics_end = get_day_bounds(day_offset, user_id)
-            analytics_expenses = get_expenses_between(analytics_start, analytics_end, user_id)
+            analytics_expenses = get_expenses_between(start_date, end_date, user_id)
         except Exception as e:
             logger.error(f"Analytics data fetch failed: {e}")
             analytics_expenses = []
@@ -1006,12 +1040,12 @@ def compare_analytics_history():
             },
             'history': {
                 'expense_count': len(history_expenses),
-                'total_amount': sum(float(e['amount']) for e in history_expenses),
+                'total_amount': sum(e['amount'] for e in history_expenses),
                 'sample_expenses': history_expenses[:3] if history_expenses else []
             },
             'analytics': {
                 'expense_count': len(analytics_expenses),
-                'total_amount': sum(float(e['amount']) for e in analytics_expenses),
+                'total_amount': sum(e['amount'] for e in analytics_expenses),
                 'sample_expenses': analytics_expenses[:3] if analytics_expenses else []
             },
             'match': len(history_expenses) == len(analytics_expenses)
@@ -1032,7 +1066,6 @@ def compare_analytics_history():
 
 @expenses_bp.route('/analytics/test-ultra-simple', methods=['GET'])
 @require_auth
-@handle_errors
 def test_analytics_ultra_simple():
     """Ultra-simple test endpoint to verify basic functionality"""
     try:
@@ -1063,7 +1096,7 @@ def test_analytics_ultra_simple():
             ORDER BY timestamp ASC
             LIMIT 5
         """
-        expense_result = run_query(expense_query, (user_id, start_date.isoformat(), end_date.isoformat()))
+        expense_result = run_query(expense_query, (user_id, to_db_timestamp(start_date), to_db_timestamp(end_date)))
         
         return jsonify({
             'success': True,
@@ -1088,7 +1121,6 @@ def test_analytics_ultra_simple():
 
 @expenses_bp.route('/analytics/test-basic', methods=['GET'])
 @require_auth
-@handle_errors
 def test_analytics_basic():
     """Basic test endpoint to verify the simplest possible functionality"""
     try:
@@ -1117,7 +1149,6 @@ def test_analytics_basic():
 
 @expenses_bp.route('/analytics/test-simple', methods=['GET'])
 @require_auth
-@handle_errors
 def test_analytics_simple():
     """Simple test endpoint to verify basic analytics functionality"""
     try:
@@ -1142,7 +1173,7 @@ def test_analytics_simple():
             AND timestamp >= %s 
             AND timestamp < %s
         """
-        expense_result = run_query(expense_query, (user_id, test_start.isoformat(), test_end.isoformat()), fetch_one=True)
+        expense_result = run_query(expense_query, (user_id, to_db_timestamp(test_start), to_db_timestamp(test_end)), fetch_one=True)
         
         return jsonify({
             'success': True,
@@ -1167,7 +1198,6 @@ def test_analytics_simple():
 
 @expenses_bp.route('/analytics/test', methods=['GET'])
 @require_auth
-@handle_errors
 def test_analytics():
     """Test endpoint to verify analytics API is working"""
     try:
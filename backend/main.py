@@ -1,11 +1,12 @@
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from flask_mail import Mail
 from datetime import timedelta
 import os
+import hashlib
 
 from utils import (
-    logger, setup_logging, add_security_headers_passive, 
+    logger, setup_logging, add_security_headers_passive, OrjsonProvider, register_error_handlers,
     DatabaseConnectionError, DEBUG, DEBUG_MODE, PORT
 )
 
@@ -24,8 +25,15 @@ logger = setup_logging()
 # Rollover migration already completed - tables should exist
 
 
+# Get the frontend directory path relative to this file
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'frontend')
+
 # Production fix - ensure proper session handling
-app = Flask(__name__)
+# Frontend assets are served by Flask's static handler (conditional requests, file_wrapper)
+app = Flask(__name__, static_folder=FRONTEND_DIR, static_url_path='')
+
+# Serialize every jsonify() response with orjson
+app.json = OrjsonProvider(app)
 
 # Get secret key from environment
 secret_key = os.environ.get('SECRET_KEY')
@@ -83,6 +91,9 @@ app.register_blueprint(categories_bp, url_prefix='/api')
 app.register_blueprint(preferences_bp, url_prefix='/api')
 app.register_blueprint(rollover_bp, url_prefix='/api')
 
+# Application and database exceptions raised by any view become JSON error responses
+register_error_handlers(app)
+
 # Error handlers for database connection issues
 @app.errorhandler(DatabaseConnectionError)
 def handle_database_error(e):
@@ -93,19 +104,22 @@ def handle_database_error(e):
         'demo_mode': True
     }), 503
 
-# Global error handler to ensure all errors return JSON
-@app.errorhandler(500)
-def handle_internal_error(e):
-    """Return JSON error response for internal server errors"""
-    return jsonify({
-        'error': 'Internal server error',
-        'message': 'An unexpected error occurred. Please try again.',
-        'demo_mode': True
-    }), 500
+# Liveness probes hit /health every few seconds; answer them before Flask routing,
+# CORS and the after_request hooks run
+HEALTH_BODY = b'{"status":"ok"}'
+
+def health_check_middleware(wsgi_app):
+    def middleware(environ, start_response):
+        if environ.get('PATH_INFO') == '/health':
+            start_response('200 OK', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(HEALTH_BODY)))
+            ])
+            return [HEALTH_BODY]
+        return wsgi_app(environ, start_response)
+    return middleware
 
-@app.route('/health')
-def health():
-    return {'status': 'ok'}
+app.wsgi_app = health_check_middleware(app.wsgi_app)
 
 @app.route('/api/config')
 def get_config():
@@ -117,51 +131,66 @@ def get_config():
         'flask_debug': DEBUG
     })
 
-# Get the frontend directory path relative to this file
-FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend')
+# Frontend routes below are for local development and nginx-less deployments;
+# in the Docker image nginx serves the frontend directly and only proxies /api and /health
+
+# HTML pages are small and requested on every navigation: keep them in memory with an ETag
+# instead of opening and stat-ing the file per hit (re-read every time in debug mode)
+_page_cache = {}
+
+def _serve_page(filename, cache_control):
+    page = None if DEBUG else _page_cache.get(filename)
+    if page is None:
+        with open(os.path.join(FRONTEND_DIR, filename), 'rb') as f:
+            body = f.read()
+        page = (body, hashlib.md5(body).hexdigest())
+        _page_cache[filename] = page
+    body, etag = page
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+NO_CACHE = 'no-cache, no-store, must-revalidate'
+PAGE_CACHE = 'public, max-age=60'
 
 @app.route('/')
 def serve_index():
-    response = send_from_directory(FRONTEND_DIR, 'index.html')
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response = _serve_page('index.html', NO_CACHE)
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
 @app.route('/auth.html')
 def serve_auth():
-    response = send_from_directory(FRONTEND_DIR, 'auth.html')
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    response = _serve_page('auth.html', NO_CACHE)
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     return response
 
 @app.route('/reset-password.html')
 def serve_reset_password():
-    return send_from_directory(FRONTEND_DIR, 'reset-password.html')
+    return _serve_page('reset-password.html', PAGE_CACHE)
 
 @app.route('/history.html')
 def serve_history():
-    return send_from_directory(FRONTEND_DIR, 'history.html')
+    return _serve_page('history.html', PAGE_CACHE)
 
 @app.route('/settings.html')
 def serve_settings():
-    return send_from_directory(FRONTEND_DIR, 'settings.html')
+    return _serve_page('settings.html', PAGE_CACHE)
 
 @app.route('/analytics.html')
 def serve_analytics():
-    return send_from_directory(FRONTEND_DIR, 'analytics.html')
-
-@app.route('/<path:filename>')
-def serve_static(filename):
-    response = send_from_directory(FRONTEND_DIR, filename)
-    
-    # Add cache control for CSS and JS files
-    if filename.endswith(('.css', '.js')):
+    return _serve_page('analytics.html', PAGE_CACHE)
+
+@app.after_request
+def add_static_cache_headers(response):
+    """Keep CSS and JS uncached so frontend deploys show up immediately"""
+    if request.endpoint == 'static' and request.path.endswith(('.css', '.js')):
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
-    
     return response
 
 if __name__ == '__main__':
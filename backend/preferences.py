@@ -2,7 +2,8 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime, date
 
 from utils import (
-    logger, run_query, get_user_daily_limit, _cache, _cache_timestamps
+    logger, run_query, run_prepared, get_user_daily_limit, invalidate_user_daily_limit,
+    to_db_timestamp
 )
 from auth import require_auth, get_current_user_id
 
@@ -64,18 +65,14 @@ def set_daily_limit():
                 updated_at = CURRENT_TIMESTAMP
             RETURNING daily_spending_limit
         '''
-        result = run_query(sql, (user_id, daily_limit), fetch_one=True)
+        result = run_query(sql, (user_id, daily_limit), fetch_one=True, write=True)
         
         if result:
             # Clear cache for this user's daily limit
-            cache_key = f"daily_limit_{user_id}"
-            if cache_key in _cache:
-                del _cache[cache_key]
-            if cache_key in _cache_timestamps:
-                del _cache_timestamps[cache_key]
+            invalidate_user_daily_limit(user_id)
             
             return jsonify({
-                'daily_limit': float(result['daily_spending_limit']),
+                'daily_limit': result['daily_spending_limit'],
                 'success': True,
                 'message': 'Daily spending limit updated successfully'
             })
@@ -110,7 +107,7 @@ def get_category_requirement():
                 VALUES (%s, TRUE)
                 RETURNING require_categories
             '''
-            result = run_query(sql, (user_id,), fetch_one=True)
+            result = run_query(sql, (user_id,), fetch_one=True, write=True)
             require_categories = result['require_categories']
         
         return jsonify({
@@ -154,7 +151,7 @@ def set_category_requirement():
                 updated_at = CURRENT_TIMESTAMP
             RETURNING require_categories
         '''
-        result = run_query(sql, (user_id, require_categories), fetch_one=True)
+        result = run_query(sql, (user_id, require_categories), fetch_one=True, write=True)
         
         if result:
             return jsonify({
@@ -196,40 +193,19 @@ def get_budgets():
         today_start, today_end = get_day_bounds(0, user_id)
         
         # Weekly spending (last 7 days)
-        week_start, _ = get_day_bounds(-6, user_id)  # 7 days ago
-        weekly_sql = '''
-            SELECT COALESCE(SUM(amount), 0) as spent
-            FROM expenses 
-            WHERE user_id = %s 
-            AND timestamp >= %s
-            AND timestamp < %s
-        '''
-        weekly_result = run_query(weekly_sql, (user_id, week_start.isoformat(), today_end.isoformat()), fetch_one=True)
-        weekly_spent = float(weekly_result['spent']) if weekly_result else 0.0
+        week_start = today_start - timedelta(days=6)  # 7 days ago
+        weekly_result = run_prepared('expenses_total_in_range', (user_id, to_db_timestamp(week_start), to_db_timestamp(today_end)), fetch_one=True)
+        weekly_spent = weekly_result['spent'] if weekly_result else 0.0
         
         # Monthly spending (last 30 days)
-        month_start, _ = get_day_bounds(-29, user_id)  # 30 days ago
-        monthly_sql = '''
-            SELECT COALESCE(SUM(amount), 0) as spent
-            FROM expenses 
-            WHERE user_id = %s 
-            AND timestamp >= %s
-            AND timestamp < %s
-        '''
-        monthly_result = run_query(monthly_sql, (user_id, month_start.isoformat(), today_end.isoformat()), fetch_one=True)
-        monthly_spent = float(monthly_result['spent']) if monthly_result else 0.0
+        month_start = today_start - timedelta(days=29)  # 30 days ago
+        monthly_result = run_prepared('expenses_total_in_range', (user_id, to_db_timestamp(month_start), to_db_timestamp(today_end)), fetch_one=True)
+        monthly_spent = monthly_result['spent'] if monthly_result else 0.0
         
         # Yearly spending (last 365 days)
-        year_start, _ = get_day_bounds(-364, user_id)  # 365 days ago
-        yearly_sql = '''
-            SELECT COALESCE(SUM(amount), 0) as spent
-            FROM expenses 
-            WHERE user_id = %s 
-            AND timestamp >= %s
-            AND timestamp < %s
-        '''
-        yearly_result = run_query(yearly_sql, (user_id, year_start.isoformat(), today_end.isoformat()), fetch_one=True)
-        yearly_spent = float(yearly_result['spent']) if yearly_result else 0.0
+        year_start = today_start - timedelta(days=364)  # 365 days ago
+        yearly_result = run_prepared('expenses_total_in_range', (user_id, to_db_timestamp(year_start), to_db_timestamp(today_end)), fetch_one=True)
+        yearly_spent = yearly_result['spent'] if yearly_result else 0.0
         
         return jsonify({
             'success': True,
@@ -374,7 +350,7 @@ def set_date_simulation():
             DO UPDATE SET 
                 simulated_date = EXCLUDED.simulated_date,
                 updated_at = NOW()
-        """, (user_id, simulated_date))
+        """, (user_id, simulated_date), write=True)
         
         logger.info(f"User {user_id} set simulated date to {simulated_date}")
         
@@ -423,7 +399,7 @@ def clear_date_simulation():
             UPDATE user_preferences 
             SET simulated_date = NULL, updated_at = NOW()
             WHERE user_id = %s
-        """, (user_id,))
+        """, (user_id,), write=True)
         
         logger.info(f"User {user_id} cleared simulated date")
         
@@ -176,14 +176,9 @@ def get_rollover_history():
             ORDER BY date DESC
         """, (user_id,))
         
-        history = []
-        for row in result:
-            history.append({
-                'date': row['date'].strftime('%Y-%m-%d'),
-                'base_daily_limit': float(row['base_daily_limit']),
-                'amount_spent': float(row['amount_spent']),
-                'rollover_amount': float(row['rollover_amount'])
-            })
+        # Rows already match the response shape: NUMERIC arrives as float and
+        # orjson renders the date as YYYY-MM-DD
+        history = result
         
         return jsonify({
             'success': True,
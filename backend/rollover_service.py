@@ -5,7 +5,7 @@ Rollover Service - Handles daily budget rollover calculations
 
 from datetime import datetime, date, timedelta
 from decimal import Decimal
-from utils import run_query, logger
+from utils import run_query, logger, get_user_daily_limit
 
 class RolloverService:
     """Service for handling daily budget rollover logic"""
@@ -29,30 +29,20 @@ class RolloverService:
             return False
     
     def get_user_daily_limit(self, user_id):
-        """Get user's base daily spending limit"""
-        try:
-            result = run_query("""
-                SELECT daily_spending_limit 
-                FROM user_preferences 
-                WHERE user_id = %s
-            """, (user_id,), fetch_one=True)
-            
-            return float(result['daily_spending_limit']) if result else 30.0
-            
-        except Exception as e:
-            self.logger.error(f"Error getting daily limit: {e}")
-            return 30.0
+        """Get user's base daily spending limit (shares the cached lookup used by the API)"""
+        return get_user_daily_limit(user_id)
     
     def get_amount_spent_on_date(self, user_id, target_date):
         """Get total amount spent by user on a specific date"""
         try:
             result = run_query("""
-                SELECT COALESCE(SUM(amount), 0) as total_spent
-                FROM expenses 
-                WHERE user_id = %s AND DATE(timestamp) = %s
+                SELECT COALESCE((
+                    SELECT total FROM expense_daily_totals
+                    WHERE user_id = %s AND day = %s::date
+                ), 0) as total_spent
             """, (user_id, target_date), fetch_one=True)
             
-            return float(result['total_spent']) if result else 0.0
+            return result['total_spent'] if result else 0.0
             
         except Exception as e:
             self.logger.error(f"Error getting amount spent: {e}")
@@ -77,8 +67,9 @@ class RolloverService:
             # Rollover is the unspent amount from the total available budget
             rollover = max(0, total_available - amount_spent)
             
-            self.logger.info(f"🔄 Rollover calculation for user {user_id} on {target_date}: "
-                           f"base=${daily_limit}, existing_rollover=${existing_rollover}, total_available=${total_available}, spent=${amount_spent}, rollover=${rollover}")
+            self.logger.debug("🔄 Rollover calculation for user %s on %s: "
+                            "base=$%s, existing_rollover=$%s, total_available=$%s, spent=$%s, rollover=$%s",
+                            user_id, target_date, daily_limit, existing_rollover, total_available, amount_spent, rollover)
             
             return rollover
             
@@ -95,8 +86,8 @@ class RolloverService:
                 WHERE user_id = %s AND date = %s
             """, (user_id, target_date), fetch_one=True)
             
-            rollover_amount = float(result['rollover_amount']) if result else 0.0
-            self.logger.info(f"🔍 Retrieved rollover for user {user_id} on {target_date}: ${rollover_amount}")
+            rollover_amount = result['rollover_amount'] if result else 0.0
+            self.logger.debug("🔍 Retrieved rollover for user %s on %s: $%s", user_id, target_date, rollover_amount)
             
             return rollover_amount
             
@@ -120,7 +111,7 @@ class RolloverService:
                     rollover_amount = EXCLUDED.rollover_amount,
                     amount_spent = EXCLUDED.amount_spent,
                     updated_at = NOW()
-            """, (user_id, target_date, daily_limit, amount_spent, rollover_amount))
+            """, (user_id, target_date, daily_limit, amount_spent, rollover_amount), write=True)
             
             self.logger.info(f"✅ Stored rollover for user {user_id} on {target_date}: ${rollover_amount}")
             
@@ -160,8 +151,8 @@ class RolloverService:
             rollover = self.get_rollover_for_date(user_id, target_date)
             effective_budget = base_budget + rollover
             
-            self.logger.info(f"Effective budget for user {user_id} on {target_date}: "
-                           f"base={base_budget}, rollover={rollover}, total={effective_budget}")
+            self.logger.debug("Effective budget for user %s on %s: base=%s, rollover=%s, total=%s",
+                            user_id, target_date, base_budget, rollover, effective_budget)
             
             return effective_budget
             
@@ -179,7 +170,7 @@ class RolloverService:
                 DO UPDATE SET 
                     daily_rollover_enabled = EXCLUDED.daily_rollover_enabled,
                     updated_at = NOW()
-            """, (user_id, enabled))
+            """, (user_id, enabled), write=True)
             
             # If enabling rollover, clear any existing rollover data for today
             # This ensures rollover only affects future days, not the current day
@@ -189,7 +180,7 @@ class RolloverService:
                 run_query("""
                     DELETE FROM daily_rollovers 
                     WHERE user_id = %s AND date = %s
-                """, (user_id, today))
+                """, (user_id, today), write=True)
                 self.logger.info(f"Cleared existing rollover data for user {user_id} on {today} when enabling rollover")
             
             self.logger.info(f"Updated rollover settings for user {user_id}: enabled={enabled}")
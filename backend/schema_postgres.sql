@@ -19,9 +19,8 @@ CREATE TABLE IF NOT EXISTS password_reset_tokens (
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
--- Create index for faster token lookups
-CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token ON password_reset_tokens(token);
-CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires ON password_reset_tokens(expires_at);
+-- Covering index for validating unused tokens without a heap fetch
+CREATE INDEX IF NOT EXISTS idx_prt_token_active ON password_reset_tokens(token) INCLUDE (id, user_id, expires_at) WHERE used = FALSE;
 
 -- Categories table for expense categorization
 CREATE TABLE IF NOT EXISTS categories (
@@ -59,10 +58,76 @@ CREATE TABLE IF NOT EXISTS expenses (
   amount DECIMAL(10,2) NOT NULL,
   description TEXT,
   category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
-  timestamp TIMESTAMP NOT NULL,
+  timestamp TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- Older databases stored expense timestamps as ISO text; convert them to native
+-- (naive UTC) timestamps so range predicates compare 8-byte values in the index
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'expenses' AND column_name = 'timestamp'
+      AND data_type IN ('text', 'character varying')
+  ) THEN
+    PERFORM set_config('timezone', 'UTC', true);
+    ALTER TABLE expenses ALTER COLUMN timestamp DROP DEFAULT;
+    ALTER TABLE expenses ALTER COLUMN timestamp TYPE TIMESTAMP
+      USING (timestamp::timestamptz AT TIME ZONE 'UTC');
+  END IF;
+END $$;
+
+-- Expenses reference categories as 'default_N' / 'custom_N' text. Derive the type
+-- (0 = default, 1 = custom) and the numeric id once on write so category joins
+-- compare integers instead of building a string per row. Bare legacy numbers
+-- stay NULL, so they keep matching no category as the old text joins did
+DO $$
+BEGIN
+  -- Earlier versions of these columns read bare numbers as default ids; rebuild them
+  IF EXISTS (
+    SELECT 1 FROM pg_attrdef d
+    JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+    WHERE d.adrelid = 'expenses'::regclass AND a.attname = 'category_type'
+      AND pg_get_expr(d.adbin, d.adrelid) LIKE '%(default_)?%'
+  ) THEN
+    ALTER TABLE expenses DROP COLUMN category_type, DROP COLUMN category_ref_id;
+    -- That also dropped the covering index; make add_performance_indexes.py re-check
+    IF to_regclass('schema_migrations') IS NOT NULL THEN
+      DELETE FROM schema_migrations WHERE id LIKE 'performance_indexes_%';
+    END IF;
+  END IF;
+END $$;
+
+ALTER TABLE expenses
+  ADD COLUMN IF NOT EXISTS category_type SMALLINT GENERATED ALWAYS AS (
+    CASE
+      WHEN category_id::text ~ '^custom_[0-9]{1,9}$' THEN 1
+      WHEN category_id::text ~ '^default_[0-9]{1,9}$' THEN 0
+    END
+  ) STORED,
+  ADD COLUMN IF NOT EXISTS category_ref_id INTEGER GENERATED ALWAYS AS (
+    CASE WHEN category_id::text ~ '^(default|custom)_[0-9]{1,9}$'
+      THEN substring(category_id::text from '[0-9]+$')::integer
+    END
+  ) STORED;
+
+-- Expense timestamps are naive UTC; let the database stamp new rows
+ALTER TABLE expenses ALTER COLUMN timestamp SET DEFAULT (NOW() AT TIME ZONE 'UTC');
+
+-- Range listings are answered by a covering index (see add_performance_indexes.py);
+-- index-only scans skip the heap only for pages marked all-visible, so vacuum this
+-- mostly-appended table after 5% new or changed rows rather than the 20% default
+DO $$
+BEGIN
+  IF current_setting('server_version_num')::int >= 130000 THEN
+    ALTER TABLE expenses SET (autovacuum_vacuum_scale_factor = 0.05,
+                              autovacuum_vacuum_insert_scale_factor = 0.05);
+  ELSE
+    ALTER TABLE expenses SET (autovacuum_vacuum_scale_factor = 0.05);
+  END IF;
+END $$;
+
 -- User preferences table for daily spending limits and category requirements
 CREATE TABLE IF NOT EXISTS user_preferences (
   id SERIAL PRIMARY KEY,
@@ -92,3 +157,44 @@ CREATE TABLE IF NOT EXISTS daily_rollovers (
   UNIQUE(user_id, date)
 );
 
+
+-- Per-user daily spending totals, maintained by a trigger on expenses so the
+-- summary endpoint reads at most 7 rows instead of aggregating raw expenses
+CREATE TABLE IF NOT EXISTS expense_daily_totals (
+  user_id INTEGER NOT NULL,
+  day DATE NOT NULL,
+  total DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+  expense_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day)
+);
+
+CREATE OR REPLACE FUNCTION maintain_expense_daily_totals() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE expense_daily_totals
+    SET total = total - OLD.amount, expense_count = expense_count - 1
+    WHERE user_id = OLD.user_id AND day = OLD.timestamp::date;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO expense_daily_totals (user_id, day, total, expense_count)
+    VALUES (NEW.user_id, NEW.timestamp::date, NEW.amount, 1)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+      total = expense_daily_totals.total + EXCLUDED.total,
+      expense_count = expense_daily_totals.expense_count + 1;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS expenses_daily_totals_trigger ON expenses;
+CREATE TRIGGER expenses_daily_totals_trigger
+  AFTER INSERT OR UPDATE OF user_id, amount, timestamp OR DELETE ON expenses
+  FOR EACH ROW EXECUTE FUNCTION maintain_expense_daily_totals();
+
+-- Backfill once from existing expenses (CREATE TRIGGER above holds a lock that
+-- blocks concurrent writes until this script commits)
+INSERT INTO expense_daily_totals (user_id, day, total, expense_count)
+SELECT user_id, timestamp::date, SUM(amount), COUNT(*)
+FROM expenses
+WHERE NOT EXISTS (SELECT 1 FROM expense_daily_totals)
+GROUP BY user_id, timestamp::date;
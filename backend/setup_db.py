@@ -7,6 +7,7 @@ Creates PostgreSQL tables in existing database
 import psycopg2
 import psycopg2.extras
 import os
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -40,9 +41,10 @@ def create_tables():
         print(f"🔌 Database connection error: {e}")
         print("⚠️  This is expected in demo mode or if database is not available")
     except Exception as e:
+        # The schema runs in one transaction, so a failure leaves none of it applied;
+        # fail the deploy instead of serving from a half-migrated database
         print(f"❌ Error creating tables: {e}")
-        # Don't exit with error code - let the app start in demo mode
-        print("⚠️  App will continue in demo mode")
+        sys.exit(1)
 
 if __name__ == "__main__":
     print("🌱 Setting up Sprout Budget Tracker database...")
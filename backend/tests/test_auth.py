@@ -204,3 +204,96 @@ class TestAuthentication:
         assert response.status_code == 401
         data = json.loads(response.data)
         assert 'error' in data
+
+class TestCircuitBreaker:
+    """Test the email provider circuit breaker state transitions"""
+    
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        """Controllable time.monotonic() for the auth module"""
+        import auth
+        now = [1000.0]
+        monkeypatch.setattr(auth.time, 'monotonic', lambda: now[0])
+        return now
+    
+    def test_opens_after_fail_max_failures(self, clock):
+        """Breaker stays closed below fail_max and opens when it is reached"""
+        from auth import CircuitBreaker
+        breaker = CircuitBreaker('Test', fail_max=3, reset_timeout=30)
+        
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.allow()
+        
+        breaker.record_failure()
+        assert not breaker.allow()
+    
+    def test_half_open_allows_one_trial(self, clock):
+        """After reset_timeout one trial call is let through and the rest held off"""
+        from auth import CircuitBreaker
+        breaker = CircuitBreaker('Test', fail_max=1, reset_timeout=30)
+        breaker.record_failure()
+        
+        clock[0] += 29
+        assert not breaker.allow()
+        
+        clock[0] += 1
+        assert breaker.allow()
+        assert not breaker.allow()
+    
+    def test_successful_trial_closes(self, clock):
+        """A successful trial call closes the breaker and resets the failure count"""
+        from auth import CircuitBreaker
+        breaker = CircuitBreaker('Test', fail_max=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        
+        clock[0] += 30
+        assert breaker.allow()
+        breaker.record_success()
+        
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.allow()
+    
+    def test_failed_trial_reopens(self, clock):
+        """A failed trial call reopens the breaker for another reset_timeout"""
+        from auth import CircuitBreaker
+        breaker = CircuitBreaker('Test', fail_max=1, reset_timeout=30)
+        breaker.record_failure()
+        
+        clock[0] += 30
+        assert breaker.allow()
+        breaker.record_failure()
+        
+        clock[0] += 29
+        assert not breaker.allow()
+        clock[0] += 1
+        assert breaker.allow()
+
+class TestGmailTimeout:
+    """Test that the Gmail fallback bounds its SMTP socket"""
+    
+    def test_smtp_connection_uses_email_timeout(self, monkeypatch):
+        """The SMTP connection is opened with EMAIL_TIMEOUT_SECONDS"""
+        import auth
+        opened = {}
+        
+        class FakeSMTP:
+            def __init__(self, server, port, timeout):
+                opened.update(server=server, port=port, timeout=timeout)
+            def set_debuglevel(self, level):
+                pass
+            def starttls(self):
+                pass
+            def login(self, username, password):
+                pass
+        
+        monkeypatch.setattr(auth.smtplib, 'SMTP', FakeSMTP)
+        with app.app_context():
+            mail_state = app.extensions['mail']
+            monkeypatch.setattr(mail_state, 'use_ssl', False)
+            host = auth._TimeoutConnection(mail_state).configure_host()
+        
+        assert isinstance(host, FakeSMTP)
+        assert opened['timeout'] == auth.EMAIL_TIMEOUT_SECONDS
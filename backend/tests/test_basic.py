@@ -43,3 +43,40 @@ class TestBasic:
         assert 'amount' in sample_expense_data
         assert 'name' in sample_category_data
         assert 'color' in sample_category_data
+
+class TestWorkerState:
+    """Per-worker state must be rebuilt from whatever threading classes are current"""
+    
+    def test_reset_worker_state_uses_current_threading_classes(self, monkeypatch):
+        """Locks created before gevent patches threading are replaced after it"""
+        import threading
+        import utils
+        
+        class PatchedLock:
+            pass
+        
+        class PatchedSemaphore:
+            def __init__(self, value):
+                self.value = value
+        
+        monkeypatch.setattr(threading, 'Lock', PatchedLock)
+        monkeypatch.setattr(threading, 'BoundedSemaphore', PatchedSemaphore)
+        monkeypatch.setattr(utils, '_cache_lock', utils._cache_lock)
+        monkeypatch.setattr(utils, '_pool_slots', utils._pool_slots)
+        monkeypatch.setattr(utils, '_connection_pool', None)
+        
+        utils.reset_worker_state()
+        
+        assert isinstance(utils._cache_lock, PatchedLock)
+        assert isinstance(utils._pool_slots, PatchedSemaphore)
+        assert utils._pool_slots.value == utils.DB_POOL_MAXCONN
+    
+    def test_gunicorn_sets_up_workers_after_patching(self):
+        """The pool is built in post_worker_init, which gunicorn runs after the gevent patch"""
+        import os
+        import runpy
+        
+        config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'gunicorn.conf.py')
+        config = runpy.run_path(config_path)
+        assert 'post_worker_init' in config
+        assert 'post_fork' not in config
@@ -27,7 +27,56 @@ class TestExpenses:
         assert response.status_code == 200
         data = json.loads(response.data)
         assert isinstance(data, list)  # API returns list directly
-    
+
+    def test_get_expenses_not_modified(self, client, sample_user_data, sample_expense_data):
+        """Test that an unchanged day is answered with 304 and changes after a new expense"""
+        client.post('/api/auth/signup',
+                   data=json.dumps(sample_user_data),
+                   content_type='application/json')
+
+        login_data = {
+            'email': sample_user_data['email'],
+            'password': sample_user_data['password']
+        }
+
+        client.post('/api/auth/login',
+                   data=json.dumps(login_data),
+                   content_type='application/json')
+
+        response = client.get('/api/expenses')
+        etag = response.headers['ETag']
+
+        response = client.get('/api/expenses', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        client.post('/api/expenses',
+                   data=json.dumps(sample_expense_data),
+                   content_type='application/json')
+
+        response = client.get('/api/expenses', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_get_expenses_malformed_day_offset(self, client, sample_user_data):
+        """Test that a malformed or out-of-range dayOffset falls back instead of erroring"""
+        client.post('/api/auth/signup',
+                   data=json.dumps(sample_user_data),
+                   content_type='application/json')
+
+        login_data = {
+            'email': sample_user_data['email'],
+            'password': sample_user_data['password']
+        }
+
+        client.post('/api/auth/login',
+                   data=json.dumps(login_data),
+                   content_type='application/json')
+
+        for day_offset in ('abc', '100000000', '-100000000'):
+            response = client.get(f'/api/expenses?dayOffset={day_offset}')
+            assert response.status_code == 200
+            assert isinstance(json.loads(response.data), list)
+
     def test_get_expenses_unauthenticated(self, client):
         """Test getting expenses when not authenticated"""
         response = client.get('/api/expenses')
@@ -74,6 +123,8 @@ class TestExpenses:
         data = json.loads(response.data)
         assert 'success' in data
         assert data['success'] == True
+        assert isinstance(data['expense']['id'], int)
+        assert data['expense']['timestamp']
     
     def test_create_expense_invalid_amount(self, client, sample_user_data, sample_expense_data):
         """Test expense creation with invalid amount"""
@@ -286,3 +337,69 @@ class TestExpenses:
         
         # This should probably be rejected
         assert response.status_code in [201, 400]
+    
+    def test_create_expenses_bulk(self, client, sample_user_data):
+        """Test inserting several expenses in one request"""
+        # Create user and login
+        client.post('/api/auth/signup', 
+                   data=json.dumps(sample_user_data),
+                   content_type='application/json')
+        
+        login_data = {
+            'email': sample_user_data['email'],
+            'password': sample_user_data['password']
+        }
+        
+        client.post('/api/auth/login', 
+                   data=json.dumps(login_data),
+                   content_type='application/json')
+        
+        # Default categories are created on signup
+        categories = json.loads(client.get('/api/categories').data)
+        category_id = categories[0]['id']
+        
+        expenses = [
+            {'amount': 10.00, 'description': 'Coffee', 'category_id': category_id},
+            {'amount': 25.50, 'description': 'Lunch', 'category_id': category_id},
+            {'amount': 4.25, 'description': 'Snack', 'category_id': category_id}
+        ]
+        response = client.post('/api/expenses/bulk', 
+                             data=json.dumps({'expenses': expenses}),
+                             content_type='application/json')
+        
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert data['inserted'] == 3
+        
+        response = client.get('/api/expenses')
+        assert len(json.loads(response.data)) == 3
+    
+    def test_create_expenses_bulk_rejects_invalid_row(self, client, sample_user_data):
+        """Test that one invalid expense rejects the whole batch"""
+        # Create user and login
+        client.post('/api/auth/signup', 
+                   data=json.dumps(sample_user_data),
+                   content_type='application/json')
+        
+        login_data = {
+            'email': sample_user_data['email'],
+            'password': sample_user_data['password']
+        }
+        
+        client.post('/api/auth/login', 
+                   data=json.dumps(login_data),
+                   content_type='application/json')
+        
+        expenses = [
+            {'amount': 10.00, 'description': 'Coffee'},
+            {'amount': -5.00, 'description': 'Refund'}
+        ]
+        response = client.post('/api/expenses/bulk', 
+                             data=json.dumps({'expenses': expenses}),
+                             content_type='application/json')
+        
+        assert response.status_code == 400
+        
+        response = client.get('/api/expenses')
+        assert json.loads(response.data) == []
@@ -1,15 +1,25 @@
 import os
+import atexit
 import bcrypt
 import secrets
 import re
 import logging
 import logging.handlers
 import time
+import threading
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from functools import wraps
+import psycopg2.pool
+import orjson
+from decimal import Decimal
+from contextlib import contextmanager
+from functools import lru_cache
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
 
 # Load environment variables
 load_dotenv()
@@ -88,44 +98,64 @@ logger = setup_logging()
 # CACHING CONFIGURATION
 # ==========================================
 
-# Simple in-memory cache for frequently accessed data
+# Simple in-memory cache for frequently accessed data, bounded to CACHE_MAX_ENTRIES
+# with the oldest entries evicted first (dicts keep insertion order)
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2048"))
 _cache = {}
 _cache_timestamps = {}
+# Guards writes and eviction; reads stay lock-free
+_cache_lock = threading.Lock()
 
 def get_cached_data(key, max_age_seconds=300):  # 5 minutes default
     """Get data from cache if it's still valid"""
-    if key in _cache and key in _cache_timestamps:
-        age = time.time() - _cache_timestamps[key]
+    cached_at = _cache_timestamps.get(key)
+    if cached_at is not None:
+        age = time.time() - cached_at
         if age < max_age_seconds:
-            return _cache[key]
+            return _cache.get(key)
         else:
             # Cache expired, remove it
-            del _cache[key]
-            del _cache_timestamps[key]
+            delete_cached_data(key)
     return None
 
 def set_cached_data(key, data, max_age_seconds=300):
-    """Store data in cache with timestamp"""
-    _cache[key] = data
-    _cache_timestamps[key] = time.time()
+    """Store data in cache with timestamp, evicting the oldest entries when full"""
+    with _cache_lock:
+        # Re-insert so a refreshed key moves to the newest position
+        _cache_timestamps.pop(key, None)
+        _cache[key] = data
+        _cache_timestamps[key] = time.time()
+        while len(_cache_timestamps) > CACHE_MAX_ENTRIES:
+            oldest = next(iter(_cache_timestamps))
+            del _cache_timestamps[oldest]
+            _cache.pop(oldest, None)
+
+def delete_cached_data(key):
+    """Drop one cached entry (no-op if it is not cached)"""
+    with _cache_lock:
+        _cache.pop(key, None)
+        _cache_timestamps.pop(key, None)
 
 def clear_cache():
     """Clear all cached data"""
-    _cache.clear()
-    _cache_timestamps.clear()
+    with _cache_lock:
+        _cache.clear()
+        _cache_timestamps.clear()
 
 def log_with_context(level, message, **context):
     """Helper function for structured logging with context"""
-    from flask import request
-    
-    extra_data = {
-        'user_id': getattr(request, 'user_id', None) if hasattr(request, 'user_id') else None,
-        'ip_address': request.remote_addr if hasattr(request, 'remote_addr') else None,
-        'user_agent': request.headers.get('User-Agent') if hasattr(request, 'headers') else None,
-        'endpoint': request.endpoint if hasattr(request, 'endpoint') else None,
-        'method': request.method if hasattr(request, 'method') else None,
-        **context
-    }
+    # One context check instead of a hasattr() probe through the proxy per field
+    if has_request_context():
+        extra_data = {
+            'user_id': getattr(request, 'user_id', None),
+            'ip_address': request.remote_addr,
+            'user_agent': request.headers.get('User-Agent'),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            **context
+        }
+    else:
+        extra_data = dict(context)
     
     # Filter out None values
     extra_data = {k: v for k, v in extra_data.items() if v is not None}
@@ -185,31 +215,32 @@ class DatabaseConnectionError(Exception):
 
 def log_security_event(event_type, details=None):
     """Log security events for monitoring - passive only"""
-    from flask import request
-    
+    in_request = has_request_context()
     logger.info(f"Security event: {event_type}", extra={
         'security_event': event_type,
-        'ip_address': request.remote_addr if hasattr(request, 'remote_addr') else None,
-        'user_agent': request.headers.get('User-Agent') if hasattr(request, 'headers') else None,
+        'ip_address': request.remote_addr if in_request else None,
+        'user_agent': request.headers.get('User-Agent') if in_request else None,
         'details': details
     })
 
-def sanitize_input_passive(text):
-    """Passive input sanitization - only removes obvious malicious content"""
-    if not text or not isinstance(text, str):
-        return text
-    
-    # Only remove obvious malicious patterns
-    malicious_patterns = [
+# Only remove obvious malicious patterns (compiled once, applied in this order)
+MALICIOUS_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
         r'<script[^>]*>.*?</script>',  # Script tags
         r'javascript:',  # JavaScript protocol
         r'data:text/html',  # Data URLs
         r'vbscript:',  # VBScript protocol
-    ]
+    )
+]
+
+def sanitize_input_passive(text):
+    """Passive input sanitization - only removes obvious malicious content"""
+    if not text or not isinstance(text, str):
+        return text
     
     sanitized = text
-    for pattern in malicious_patterns:
-        sanitized = re.sub(pattern, '', sanitized, flags=re.IGNORECASE)
+    for pattern in MALICIOUS_PATTERNS:
+        sanitized = pattern.sub('', sanitized)
     
     return sanitized
 
@@ -230,80 +261,430 @@ PORT = int(os.environ.get("PORT", "5001"))  # Server port
 DEBUG = os.environ.get("FLASK_DEBUG", "False").lower() == "true"  # Debug mode
 DEBUG_MODE = os.environ.get("DEBUG_MODE", "False").lower() == "true"  # Debug mode for UI features
 
+# Decode NUMERIC columns (amounts, budgets) straight to float in the driver instead of
+# building Decimal objects that every endpoint then converts with float()
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    'DEC2FLOAT',
+    lambda value, cur: float(value) if value is not None else None
+)
+psycopg2.extensions.register_type(DEC2FLOAT)
+
+# Connection pool sizing (per worker process)
+DB_POOL_MAXCONN = int(os.environ.get("DB_POOL_SIZE", "20"))
+DB_POOL_MINCONN = min(2, DB_POOL_MAXCONN)
+# Seconds a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+
+# Lazily created so each gunicorn worker builds its own pool after fork
+_connection_pool = None
+# ThreadedConnectionPool fails immediately when exhausted; these slots make
+# callers queue for a connection instead
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAXCONN)
+
+# Hot queries prepared per connection on first use and run with EXECUTE, so Postgres
+# skips parsing and planning on every call: name -> (parameter types, statement)
+# The expense list is shaped into one JSON array by Postgres (newest first)
+_EXPENSES_WITH_CATEGORY = '''
+    SELECT COALESCE(json_agg(json_build_object(
+               'id', e.id,
+               'amount', e.amount,
+               'description', e.description,
+               'timestamp', e.timestamp,
+               'category', CASE WHEN COALESCE(dc.name, cc.name) IS NOT NULL THEN json_build_object(
+                   'id', e.category_ref_id::text,
+                   'name', COALESCE(dc.name, cc.name),
+                   'icon', COALESCE(dc.icon, cc.icon),
+                   'color', COALESCE(dc.color, cc.color),
+                   'is_default', e.category_type = 0
+               ) END
+           ) ORDER BY e.timestamp DESC), '[]'::json)
+    FROM expenses e
+    LEFT JOIN default_categories dc ON e.category_type = 0 AND dc.id = e.category_ref_id
+    LEFT JOIN custom_categories cc ON e.category_type = 1 AND cc.id = e.category_ref_id AND cc.user_id = e.user_id
+'''
+PREPARED_STATEMENTS = {
+    'expenses_in_range': ('integer, timestamp, timestamp', '''
+        SELECT id, amount, description, timestamp 
+        FROM expenses 
+        WHERE user_id = $1 AND timestamp >= $2 AND timestamp < $3 
+        ORDER BY timestamp DESC
+    '''),
+    'user_daily_limit': ('integer', '''
+        SELECT daily_spending_limit FROM user_preferences WHERE user_id = $1
+    '''),
+    'user_require_categories': ('integer', '''
+        SELECT require_categories FROM user_preferences WHERE user_id = $1
+    '''),
+    # Changes whenever a row in the window is inserted, updated (new xmin) or deleted (count)
+    'expenses_in_range_version': ('integer, timestamp, timestamp', '''
+        SELECT COUNT(*), COALESCE(MAX(xmin::text::bigint), 0)
+        FROM expenses
+        WHERE user_id = $1 AND timestamp >= $2 AND timestamp < $3
+    '''),
+    'expenses_total_in_range': ('integer, timestamp, timestamp', '''
+        SELECT COALESCE(SUM(amount), 0) AS spent
+        FROM expenses
+        WHERE user_id = $1 AND timestamp >= $2 AND timestamp < $3
+    '''),
+    # Default + custom categories with the user's budgets, in one UNION ALL
+    'user_categories': ('integer', '''
+        SELECT 
+            'default_' || dc.id as id,
+            dc.name,
+            dc.icon,
+            dc.color,
+            dc.created_at,
+            COALESCE(ucb.daily_budget, 0.0) as daily_budget,
+            true as is_default,
+            false as is_custom
+        FROM default_categories dc
+        LEFT JOIN user_category_budgets ucb ON ucb.category_id = dc.id AND ucb.category_type = 'default' AND ucb.user_id = $1
+
+        UNION ALL
+
+        SELECT 
+            'custom_' || cc.id as id,
+            cc.name,
+            cc.icon,
+            cc.color,
+            cc.created_at,
+            COALESCE(ucb.daily_budget, cc.daily_budget) as daily_budget,
+            false as is_default,
+            true as is_custom
+        FROM custom_categories cc
+        LEFT JOIN user_category_budgets ucb ON ucb.category_id = cc.id AND ucb.category_type = 'custom' AND ucb.user_id = $1
+        WHERE cc.user_id = $1
+
+        ORDER BY name ASC
+    '''),
+    'expenses_spent_by_category': ('integer, timestamp, timestamp', '''
+        SELECT category_type, category_ref_id, SUM(amount)
+        FROM expenses
+        WHERE user_id = $1 AND timestamp >= $2 AND timestamp < $3 AND category_type IS NOT NULL
+        GROUP BY 1, 2
+    '''),
+    'expenses_between': ('integer, timestamp, timestamp', _EXPENSES_WITH_CATEGORY + '''
+        WHERE e.user_id = $1 AND e.timestamp >= $2 AND e.timestamp < $3
+    '''),
+    'expenses_between_in_category': ('integer, timestamp, timestamp, text', _EXPENSES_WITH_CATEGORY + '''
+        WHERE e.user_id = $1 AND e.timestamp >= $2 AND e.timestamp < $3 AND e.category_id = $4
+    '''),
+}
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which PREPARED_STATEMENTS have been prepared on it"""
+    # The _pool_slots semaphore held while the connection is borrowed
+    pool_slot = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names PREPAREd on this session, and ones whose PREPARE failed (run as plain SQL)
+        self.prepared_names = set()
+        self.unpreparable_names = set()
+
+_PLACEHOLDER_RE = re.compile(r'\$(\d+)')
+
+@lru_cache(maxsize=None)
+def _plain_statement(name):
+    """A PREPARED_STATEMENTS entry rewritten for psycopg2: (sql with %s placeholders, parameter order)"""
+    statement = PREPARED_STATEMENTS[name][1].replace('%', '%%')
+    order = tuple(int(n) - 1 for n in _PLACEHOLDER_RE.findall(statement))
+    return _PLACEHOLDER_RE.sub('%s', statement), order
+
+def _prepared_sql(conn, name, params):
+    """
+    SQL and parameters for running a registered statement on this connection.
+
+    The statement is PREPAREd on first use; if that fails (e.g. a relation it
+    references is missing) the plain SQL is run instead, so one broken statement
+    only affects the endpoints that use it.
+    """
+    prepared = getattr(conn, 'prepared_names', None)
+    if prepared is None or name in conn.unpreparable_names:
+        sql, order = _plain_statement(name)
+        return sql, tuple(params[i] for i in order)
+    if name not in prepared:
+        param_types, statement = PREPARED_STATEMENTS[name]
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"PREPARE {name} ({param_types}) AS {statement}")
+            conn.commit()
+            prepared.add(name)
+        except psycopg2.Error as e:
+            conn.rollback()
+            conn.unpreparable_names.add(name)
+            logger.warning(f"Could not prepare statement {name}; running it unprepared", extra={
+                'error_code': e.pgcode,
+                'error_message': str(e)
+            })
+            return _prepared_sql(conn, name, params)
+    placeholders = ', '.join(['%s'] * len(params))
+    return f"EXECUTE {name} ({placeholders})", params
+
+def get_connection_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _connection_pool
+    if _connection_pool is None or _connection_pool.closed:
+        _connection_pool = psycopg2.pool.ThreadedConnectionPool(
+            DB_POOL_MINCONN, DB_POOL_MAXCONN, dsn=DATABASE_URL,
+            connection_factory=PreparingConnection,
+            # Expense timestamps are naive UTC; pin the session time zone so NOW(),
+            # column defaults and any timestamptz<->timestamp conversion agree with them.
+            # JIT compilation only pays off for long analytic queries; for these
+            # millisecond lookups it is pure start-up overhead
+            options='-c timezone=UTC -c jit=off',
+            # Probe idle pooled connections so ones silently dropped by a proxy,
+            # NAT or failover are detected instead of hanging the next query
+            keepalives=1, keepalives_idle=60, keepalives_interval=10, keepalives_count=5
+        )
+        logger.info(f"Database connection pool created (min={DB_POOL_MINCONN}, max={DB_POOL_MAXCONN})")
+    return _connection_pool
+
+def close_connection_pool():
+    """Close every pooled connection (registered with atexit for clean shutdown)"""
+    if _connection_pool is not None and not _connection_pool.closed:
+        _connection_pool.closeall()
+
+atexit.register(close_connection_pool)
+
+def reset_connection_pool():
+    """Drop the current pool so the next checkout builds a fresh one (used after fork)"""
+    global _connection_pool, _pool_slots
+    if _connection_pool is not None and not _connection_pool.closed:
+        _connection_pool.closeall()
+    _connection_pool = None
+    _pool_slots = threading.BoundedSemaphore(DB_POOL_MAXCONN)
+
+def reset_worker_state():
+    """
+    Rebuild per-process pool and locks in a freshly started server worker.
+
+    Must run after the worker has monkey-patched threading (gevent), so the
+    semaphore and locks are created from the patched, greenlet-aware classes.
+    """
+    global _cache_lock
+    _cache_lock = threading.Lock()
+    reset_connection_pool()
+
 def get_db_connection():
-    """Get a database connection with dict cursor for easy column access"""
+    """Borrow a database connection from the pool - return it with release_db_connection()"""
+    slots = _pool_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        logger.error("Timed out waiting for a pooled database connection", extra={
+            'pool_size': DB_POOL_MAXCONN,
+            'timeout': DB_POOL_TIMEOUT
+        })
+        raise DatabaseConnectionError("Database connection pool exhausted")
+    conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        logger.debug("Database connection established successfully")
+        conn = get_connection_pool().getconn()
+        conn.pool_slot = slots
+        logger.debug("Database connection borrowed from pool")
         return conn
     except Exception as e:
+        if conn is not None:
+            conn.pool_slot = None
+            get_connection_pool().putconn(conn, close=True)
+        slots.release()
         logger.error("Failed to establish database connection", exc_info=True, extra={
             'database_url': DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'unknown'
         })
         raise DatabaseConnectionError(f"Database connection failed: {e}")
 
-def run_query(sql, params=None, fetch_one=False, fetch_all=True):
+def release_db_connection(conn):
+    """Return a borrowed connection to the pool, discarding it if it is broken"""
+    if conn is None:
+        return
+    slot = getattr(conn, 'pool_slot', None)
+    if slot is not None:
+        conn.pool_slot = None
+    try:
+        if _connection_pool is not None and not _connection_pool.closed:
+            _connection_pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        if slot is not None:
+            slot.release()
+
+@contextmanager
+def db_connection():
+    """Context manager that borrows a pooled connection and always returns it"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def _sql_for_log(sql):
+    """Truncated SQL for log records (a callable statement may fail before it is resolved)"""
+    if callable(sql):
+        return '<unresolved statement>'
+    return sql[:100] + '...' if len(sql) > 100 else sql
+
+def run_query(sql, params=None, fetch_one=False, fetch_all=True, write=False, as_dict=True):
     """
     Helper function to run database queries with proper connection handling
     
     Args:
-        sql (str): SQL query string
+        sql (str): SQL query string, or a callable taking the borrowed
+            connection and returning (sql, params)
         params (tuple): Query parameters  
         fetch_one (bool): Return single row
         fetch_all (bool): Return all rows (default)
+        write (bool): Statement modifies data and must be committed
+        as_dict (bool): Return rows as dictionaries (default) or plain tuples
     
     Returns:
-        dict or list: Query results as dictionaries
+        dict or list: Query results as dictionaries (or tuples), or the
+        affected row count for writes without a RETURNING clause
     """
     conn = None
     try:
         conn = get_db_connection()
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        if callable(sql):
+            sql, params = sql(conn)
+        cursor_factory = psycopg2.extras.RealDictCursor if as_dict else None
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
             cur.execute(sql, params or ())
             
-            if sql.strip().upper().startswith(('INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'DROP')):
+            if write:
                 conn.commit()
-                # Check if query has RETURNING clause
-                if 'RETURNING' in sql.upper():
-                    if fetch_one:
-                        result = cur.fetchone()
-                        return dict(result) if result else None
-                    elif fetch_all:
-                        results = cur.fetchall()
-                        return [dict(row) for row in results]
-                    else:
-                        return cur.fetchone()
-                else:
+                # Only statements with a RETURNING clause produce a result set
+                if cur.description is None:
                     return cur.rowcount
-            elif fetch_one:
-                result = cur.fetchone()
-                return dict(result) if result else None
+                if not fetch_one and not fetch_all:
+                    return cur.fetchone()
+            
+            # Rows are returned as the cursor built them (RealDictRow is already a dict)
+            if fetch_one:
+                return cur.fetchone()
             elif fetch_all:
-                results = cur.fetchall()
-                return [dict(row) for row in results]
+                return cur.fetchall()
             else:
                 return None
     except psycopg2.Error as e:
-        if conn:
+        if conn and not conn.closed:
             conn.rollback()
         logger.error("Database query failed", exc_info=True, extra={
-            'sql': sql[:100] + '...' if len(sql) > 100 else sql,
+            'sql': _sql_for_log(sql),
             'params': str(params)[:100] if params else None,
             'error_code': e.pgcode,
             'error_message': str(e)
         })
         raise DatabaseConnectionError(f"Database unavailable: {e}")
     except Exception as e:
-        if conn:
+        if conn and not conn.closed:
             conn.rollback()
         logger.error("Unexpected error in database query", exc_info=True, extra={
-            'sql': sql[:100] + '...' if len(sql) > 100 else sql,
+            'sql': _sql_for_log(sql),
             'params': str(params)[:100] if params else None
         })
         raise e
     finally:
-        if conn:
-            conn.close()
+        release_db_connection(conn)
+
+def run_prepared(name, params, **kwargs):
+    """Run a statement from PREPARED_STATEMENTS by name; accepts run_query's keyword arguments"""
+    return run_query(lambda conn: _prepared_sql(conn, name, params), **kwargs)
+
+def run_tx(work, as_dict=True):
+    """
+    Run several statements on one pooled connection as a single transaction
+
+    `work` receives a cursor and its return value is passed through. The
+    transaction commits once when it returns and rolls back if it raises.
+    """
+    conn = get_db_connection()
+    try:
+        cursor_factory = psycopg2.extras.RealDictCursor if as_dict else None
+        with conn:
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                return work(cur)
+    except psycopg2.Error as e:
+        logger.error("Database transaction failed", exc_info=True, extra={
+            'error_code': e.pgcode,
+            'error_message': str(e)
+        })
+        raise DatabaseConnectionError(f"Database unavailable: {e}")
+    finally:
+        release_db_connection(conn)
+
+def iter_query(sql, params=None, itersize=2000, as_dict=True):
+    """
+    Stream the rows of a large SELECT through a server-side (named) cursor
+
+    Rows arrive from Postgres in batches of `itersize`, so callers that fold them
+    as they go never hold the whole result in memory. The connection stays
+    checked out until the generator is exhausted or closed.
+    """
+    conn = get_db_connection()
+    try:
+        cursor_factory = psycopg2.extras.RealDictCursor if as_dict else None
+        with conn.cursor('stream_rows', cursor_factory=cursor_factory) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params or ())
+            yield from cur
+        conn.commit()
+    except psycopg2.Error as e:
+        if not conn.closed:
+            conn.rollback()
+        logger.error("Database streaming query failed", exc_info=True, extra={
+            'sql': sql[:100] + '...' if len(sql) > 100 else sql,
+            'params': str(params)[:100] if params else None,
+            'error_code': e.pgcode,
+            'error_message': str(e)
+        })
+        raise DatabaseConnectionError(f"Database unavailable: {e}")
+    finally:
+        # putconn rolls back whatever an abandoned generator left open
+        release_db_connection(conn)
+
+def run_bulk_insert(sql, rows, template=None, page_size=500, returning=False):
+    """
+    Insert many rows in a single transaction using execute_values
+
+    Args:
+        sql (str): INSERT statement with a single %s placeholder for the VALUES list
+        rows (list): Sequence of row tuples
+        template (str): Per-row template, e.g. "(%s, %s, %s)"
+        page_size (int): Rows sent per statement
+        returning (bool): Statement has a RETURNING clause; return its rows as dictionaries
+
+    Returns:
+        int or list: Number of rows inserted, or the RETURNING rows
+    """
+    if not rows:
+        return [] if returning else 0
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            results = psycopg2.extras.execute_values(
+                cur, sql, rows, template=template, page_size=page_size, fetch=returning
+            )
+        conn.commit()
+        return results if returning else len(rows)
+    except psycopg2.Error as e:
+        if conn and not conn.closed:
+            conn.rollback()
+        logger.error("Bulk insert failed", exc_info=True, extra={
+            'sql': sql[:100] + '...' if len(sql) > 100 else sql,
+            'row_count': len(rows),
+            'error_code': e.pgcode,
+            'error_message': str(e)
+        })
+        raise DatabaseConnectionError(f"Database unavailable: {e}")
+    except Exception as e:
+        if conn and not conn.closed:
+            conn.rollback()
+        logger.error("Unexpected error in bulk insert", exc_info=True, extra={
+            'sql': sql[:100] + '...' if len(sql) > 100 else sql,
+            'row_count': len(rows)
+        })
+        raise e
+    finally:
+        release_db_connection(conn)
 
 # ==========================================
 # AUTHENTICATION HELPER FUNCTIONS
@@ -317,10 +698,11 @@ def verify_password(password, hashed):
     """Verify a password against its hash"""
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 def validate_email(email):
     """Validate email format using regex"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return EMAIL_PATTERN.match(email) is not None
 
 def generate_reset_token():
     """Generate a secure random token for password reset"""
@@ -412,55 +794,117 @@ def validate_category_data(data):
 # ERROR HANDLER DECORATOR
 # ==========================================
 
-def handle_errors(f):
-    """Decorator to handle errors consistently across endpoints"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        try:
-            return f(*args, **kwargs)
-        except SproutError as e:
-            logger.warning(f"Application error: {e.message}", extra={
-                'error_code': e.code,
-                'status_code': e.status_code,
-                'field': e.field
-            })
-            return jsonify({
-                'error': e.message,
-                'code': e.code,
-                'field': e.field
-            }), e.status_code
-        except psycopg2.OperationalError as e:
-            logger.error("Database connection error", exc_info=True)
-            return jsonify({
-                'error': 'Database temporarily unavailable. Please try again.',
-                'code': 'DATABASE_UNAVAILABLE'
-            }), 503
-        except psycopg2.IntegrityError as e:
-            logger.warning("Data integrity violation", extra={
-                'constraint': getattr(e.diag, 'constraint_name', 'unknown')
-            })
-            return jsonify({
-                'error': 'Invalid data provided. Please check your input.',
-                'code': 'DATA_INTEGRITY_ERROR'
-            }), 400
-        except ValueError as e:
-            logger.warning("Invalid input data", extra={'error': str(e)})
-            return jsonify({
-                'error': 'Please provide valid data.',
-                'code': 'INVALID_INPUT'
-            }), 400
-        except Exception as e:
-            logger.error("Unexpected error", exc_info=True)
-            return jsonify({
-                'error': 'An unexpected error occurred. Please try again.',
-                'code': 'INTERNAL_ERROR'
-            }), 500
-    return decorated_function
+def _handle_sprout_error(e):
+    logger.warning(f"Application error: {e.message}", extra={
+        'error_code': e.code,
+        'status_code': e.status_code,
+        'field': e.field
+    })
+    return jsonify({
+        'error': e.message,
+        'code': e.code,
+        'field': e.field
+    }), e.status_code
+
+def _handle_operational_error(e):
+    logger.error("Database connection error", exc_info=True)
+    return jsonify({
+        'error': 'Database temporarily unavailable. Please try again.',
+        'code': 'DATABASE_UNAVAILABLE'
+    }), 503
+
+def _handle_integrity_error(e):
+    logger.warning("Data integrity violation", extra={
+        'constraint': getattr(e.diag, 'constraint_name', 'unknown')
+    })
+    return jsonify({
+        'error': 'Invalid data provided. Please check your input.',
+        'code': 'DATA_INTEGRITY_ERROR'
+    }), 400
+
+def _handle_value_error(e):
+    logger.warning("Invalid input data", extra={'error': str(e)})
+    return jsonify({
+        'error': 'Please provide valid data.',
+        'code': 'INVALID_INPUT'
+    }), 400
+
+def _handle_unexpected_error(e):
+    # HTTP errors (404, 405, ...) keep Flask's own handling; 500s, including
+    # abort(500), get the same JSON body as uncaught exceptions
+    if isinstance(e, HTTPException) and e.code != 500:
+        return e
+    logger.error("Unexpected error", exc_info=True)
+    return jsonify({
+        'error': 'Internal server error',
+        'message': 'An unexpected error occurred. Please try again.',
+        'code': 'INTERNAL_ERROR',
+        'demo_mode': True
+    }), 500
+
+def register_error_handlers(app):
+    """
+    Map application and database exceptions to consistent JSON error responses
+
+    Registered once on the app instead of wrapping every view in a decorator;
+    Flask picks the most specific handler for the raised exception's class.
+    """
+    app.register_error_handler(SproutError, _handle_sprout_error)
+    app.register_error_handler(psycopg2.OperationalError, _handle_operational_error)
+    app.register_error_handler(psycopg2.IntegrityError, _handle_integrity_error)
+    app.register_error_handler(ValueError, _handle_value_error)
+    app.register_error_handler(Exception, _handle_unexpected_error)
 
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
 
+def _json_default(obj):
+    """Serialize types orjson does not handle natively"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def json_response(data, status=200):
+    """Build a JSON response with orjson (datetimes are rendered like isoformat())"""
+    from flask import Response
+    return Response(orjson.dumps(data, default=_json_default), status=status, mimetype='application/json')
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson, so jsonify() shares json_response()'s fast path"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_json_default), mimetype=self.mimetype)
+
+SECONDS_PER_DAY = 86400
+UNIX_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+@lru_cache(maxsize=256)
+def _day_bounds(base_ordinal, day_offset):
+    """UTC-midnight start/end of the day `day_offset` days from the given date ordinal"""
+    start = datetime.fromordinal(base_ordinal + day_offset).replace(tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+# Furthest a dayOffset may reach (about ten years either way)
+MAX_DAY_OFFSET = 3650
+
+def parse_day_offset():
+    """
+    Read ?dayOffset=N from the current request, clamped to +/-MAX_DAY_OFFSET
+
+    Missing or malformed values mean today (0) rather than raising, so junk
+    query strings never reach the error handlers or build absurd date ranges.
+    """
+    day_offset = request.args.get('dayOffset', 0, type=int)
+    return max(-MAX_DAY_OFFSET, min(MAX_DAY_OFFSET, day_offset))
+
 def get_day_bounds(day_offset=0, user_id=None):
     """Get the start and end of the target day (using dayOffset) - OPTIMIZED"""
     global _simulated_date_column_exists
@@ -487,105 +931,61 @@ def get_day_bounds(day_offset=0, user_id=None):
                 
                 if simulated_date_result and simulated_date_result['simulated_date']:
                     # Use simulated date as the base
-                    simulated_date = simulated_date_result['simulated_date']
-                    target_day = datetime.combine(simulated_date, datetime.min.time()).replace(tzinfo=timezone.utc)
-                    target_day = target_day + timedelta(days=day_offset)
-                    start = target_day
-                    end = target_day + timedelta(days=1)
-                    return start, end
+                    return _day_bounds(simulated_date_result['simulated_date'].toordinal(), day_offset)
         except Exception as e:
             logger.warning(f"Could not check simulated date for user {user_id}: {e}")
     
-    # Fallback to real current date
-    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    target_day = today + timedelta(days=day_offset)
-    start = target_day
-    end = target_day + timedelta(days=1)
-    return start, end
+    # Fallback to real current date; the bounds are memoized per (date, offset), and
+    # today's ordinal comes from integer epoch math without building a datetime
+    return _day_bounds(UNIX_EPOCH_ORDINAL + int(time.time()) // SECONDS_PER_DAY, day_offset)
+
+def to_db_timestamp(dt):
+    """Convert a datetime to naive UTC for binding against the (naive UTC) timestamp columns"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def get_day_bounds_range(day_offset, days, user_id=None):
+    """
+    Get the start and end of a run of consecutive days ending on dayOffset
+
+    Equivalent to combining get_day_bounds(day_offset - (days - 1)) and
+    get_day_bounds(day_offset), but looks up the simulated date only once.
+    """
+    start, end = get_day_bounds(day_offset, user_id)
+    return start - timedelta(days=days - 1), end
 
 def get_expenses_between(start, end, user_id, category_id=None):
     """Get all expenses between two datetimes with optional category filtering"""
+    # Two prepared variants rather than "$4 IS NULL OR ...": a generic plan for the
+    # combined form could not use the (user_id, category_id, timestamp) index
+    params = (user_id, to_db_timestamp(start), to_db_timestamp(end))
     if category_id:
-        # Filter by specific category
-        sql = '''
-            SELECT e.id, e.amount, e.description, e.timestamp, e.category_id,
-                   COALESCE(dc.name, cc.name) as category_name,
-                   COALESCE(dc.icon, cc.icon) as category_icon,
-                   COALESCE(dc.color, cc.color) as category_color
-            FROM expenses e
-            LEFT JOIN default_categories dc ON e.category_id = CONCAT('default_', dc.id::text)
-            LEFT JOIN custom_categories cc ON e.category_id = CONCAT('custom_', cc.id::text) AND cc.user_id = e.user_id
-            WHERE e.user_id = %s AND e.timestamp >= %s AND e.timestamp < %s AND e.category_id = %s
-            ORDER BY e.timestamp DESC
-        '''
-        params = (user_id, start.isoformat(), end.isoformat(), category_id)
+        row = run_prepared('expenses_between_in_category', params + (category_id,), fetch_one=True, as_dict=False)
     else:
-        # Get all expenses with category information
-        sql = '''
-            SELECT e.id, e.amount, e.description, e.timestamp, e.category_id,
-                   COALESCE(dc.name, cc.name) as category_name,
-                   COALESCE(dc.icon, cc.icon) as category_icon,
-                   COALESCE(dc.color, cc.color) as category_color
-            FROM expenses e
-            LEFT JOIN default_categories dc ON e.category_id = CONCAT('default_', dc.id::text)
-            LEFT JOIN custom_categories cc ON e.category_id = CONCAT('custom_', cc.id::text) AND cc.user_id = e.user_id
-            WHERE e.user_id = %s AND e.timestamp >= %s AND e.timestamp < %s
-            ORDER BY e.timestamp DESC
-        '''
-        params = (user_id, start.isoformat(), end.isoformat())
-    
-    raw_expenses = run_query(sql, params)
-    
-    # Convert data types for consistency
-    expenses = []
-    for e in raw_expenses:
-        expense_data = {
-            'id': e['id'],  # Include the expense ID
-            'amount': float(e['amount']),
-            'description': e['description'],
-            'timestamp': e['timestamp'].isoformat() if hasattr(e['timestamp'], 'isoformat') else str(e['timestamp'])
-        }
-        
-        # Add category information if present
-        if e['category_id'] and e['category_name']:
-            # Determine if this is a default or custom category
-            if e['category_id'].startswith('default_'):
-                is_default = True
-                numeric_id = e['category_id'].replace('default_', '')
-            elif e['category_id'].startswith('custom_'):
-                is_default = False
-                numeric_id = e['category_id'].replace('custom_', '')
-            else:
-                # Legacy format, assume custom
-                is_default = False
-                numeric_id = e['category_id']
-            
-            expense_data['category'] = {
-                'id': numeric_id,
-                'name': e['category_name'],
-                'icon': e['category_icon'],
-                'color': e['category_color'],
-                'is_default': is_default
-            }
-        else:
-            expense_data['category'] = None
-            
-        expenses.append(expense_data)
+        row = run_prepared('expenses_between', params, fetch_one=True, as_dict=False)
     
-    return expenses
+    # A single json value, already in the response shape; psycopg2 decodes it to a list
+    return row[0]
+
+# Short enough that a limit changed through another gunicorn worker is picked up quickly
+DAILY_LIMIT_CACHE_SECONDS = 60
+
+def invalidate_user_daily_limit(user_id):
+    """Drop the cached daily limit after the user changes it"""
+    delete_cached_data(f"daily_limit_{user_id}")
 
 def get_user_daily_limit(user_id=0):
     """Get the user's daily spending limit from preferences with caching"""
     cache_key = f"daily_limit_{user_id}"
     
     # Check cache first
-    cached_value = get_cached_data(cache_key, max_age_seconds=600)  # 10 minutes
+    cached_value = get_cached_data(cache_key, max_age_seconds=DAILY_LIMIT_CACHE_SECONDS)
     if cached_value is not None:
         return cached_value
     
     try:
-        sql = 'SELECT daily_spending_limit FROM user_preferences WHERE user_id = %s'
-        result = run_query(sql, (user_id,), fetch_one=True)
+        result = run_prepared('user_daily_limit', (user_id,), fetch_one=True)
         if result:
             daily_limit = float(result['daily_spending_limit'])
         else:
@@ -595,63 +995,55 @@ def get_user_daily_limit(user_id=0):
                 VALUES (%s, %s)
                 RETURNING daily_spending_limit
             '''
-            result = run_query(sql, (user_id, 30.0), fetch_one=True)
+            result = run_query(sql, (user_id, 30.0), fetch_one=True, write=True)
             daily_limit = float(result['daily_spending_limit']) if result else 30.0
         
         # Cache the result
-        set_cached_data(cache_key, daily_limit, max_age_seconds=600)
+        set_cached_data(cache_key, daily_limit, max_age_seconds=DAILY_LIMIT_CACHE_SECONDS)
         return daily_limit
         
     except Exception as e:
         logger.error(f"Error getting user daily limit: {e}")
         return 30.0  # Fallback to default
 
-def create_default_categories(user_id):
-    """Create default categories for a new user"""
-    # First check if user already has categories
-    existing_count = run_query(
-        'SELECT COUNT(*) as count FROM categories WHERE user_id = %s',
-        (user_id,),
-        fetch_one=True
-    )
-    
-    if existing_count and existing_count['count'] > 0:
-        return
+# Seed categories for new accounts
+DEFAULT_CATEGORIES = [
+    ('Food & Dining', '🍽️', '#FF6B6B'),
+    ('Transportation', '🚗', '#4ECDC4'),
+    ('Shopping', '🛒', '#45B7D1'),
+    ('Health & Fitness', '💪', '#96CEB4'),
+    ('Entertainment', '🎬', '#FECA57'),
+    ('Bills & Utilities', '⚡', '#FF9FF3'),
+    ('Other', '📝', '#6B7280')
+]
+# Same data column-wise, bound as three arrays for a single unnest() insert
+_DEFAULT_CATEGORY_COLUMNS = tuple(list(column) for column in zip(*DEFAULT_CATEGORIES))
+
+def create_default_categories(user_id, cur=None):
+    """
+    Create default categories for a new user
+
+    Pass `cur` to run inside the caller's transaction (see run_tx); otherwise
+    the inserts get a transaction of their own.
+    """
+    if cur is None:
+        return run_tx(lambda cur: create_default_categories(user_id, cur))
     
-    default_categories = [
-        ('Food & Dining', '🍽️', '#FF6B6B'),
-        ('Transportation', '🚗', '#4ECDC4'),
-        ('Shopping', '🛒', '#45B7D1'),
-        ('Health & Fitness', '💪', '#96CEB4'),
-        ('Entertainment', '🎬', '#FECA57'),
-        ('Bills & Utilities', '⚡', '#FF9FF3'),
-        ('Other', '📝', '#6B7280')
-    ]
-    
-    for name, icon, color in default_categories:
-        # Check if this category already exists for this user
-        existing = run_query(
-            'SELECT id FROM categories WHERE user_id = %s AND name = %s',
-            (user_id, name),
-            fetch_one=True
-        )
-        
-        if not existing:
-            sql = '''
-                INSERT INTO categories (user_id, name, icon, color, is_default)
-                VALUES (%s, %s, %s, %s, TRUE)
-            '''
-            run_query(sql, (user_id, name, icon, color), fetch_all=False)
-        else:
-            pass
+    # One statement seeds every category, and only if the user has none yet
+    names, icons, colors = _DEFAULT_CATEGORY_COLUMNS
+    cur.execute('''
+        INSERT INTO categories (user_id, name, icon, color, is_default)
+        SELECT %s, v.name, v.icon, v.color, TRUE
+        FROM unnest(%s::text[], %s::text[], %s::text[]) AS v(name, icon, color)
+        WHERE NOT EXISTS (SELECT 1 FROM categories WHERE user_id = %s)
+    ''', (user_id, names, icons, colors, user_id))
     
     # Create default user preferences (use ON CONFLICT to handle duplicates)
-    sql = '''
+    cur.execute('''
         INSERT INTO user_preferences (user_id, daily_spending_limit)
         VALUES (%s, 30.00)
         ON CONFLICT (user_id) DO NOTHING
-    '''
-    run_query(sql, (user_id,), fetch_all=False)
+    ''', (user_id,))
 
 # Import jsonify for error handler
 from flask import jsonify
@@ -1,15 +1,24 @@
 # Gunicorn configuration for production deployment
 
+import multiprocessing
 import os
 
 # Server socket - bind to port 5000 internally (nginx proxies external PORT)
 bind = "0.0.0.0:5000"
 backlog = 2048
 
-# Worker processes
+# Worker processes: a single worker by default. The response caches
+# live in each worker's memory and are only invalidated there, so extra workers
+# would serve stale data - concurrency comes from threads instead. Raise this only
+# once cache invalidation is shared between processes.
 workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
-worker_class = "sync"
-worker_connections = 1000
+# Threaded workers: requests spend most of their time waiting on Postgres, so each
+# worker overlaps several of them on its (thread-safe) connection pool.
+# Threads default to 2 x CPUs + 1 - the scaling multiple workers would otherwise provide.
+# GUNICORN_WORKER_CLASS=gevent switches to cooperative I/O (needs gevent + psycogreen installed)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', multiprocessing.cpu_count() * 2 + 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
 timeout = 30
 keepalive = 2
 
@@ -33,6 +42,19 @@ user = None
 group = None
 tmp_upload_dir = None
 
+# Each worker must own its database pool - never share sockets inherited from the master.
+# Gunicorn calls post_fork, then the worker's init_process (where the gevent worker runs
+# monkey.patch_all()), and post_worker_init at the end of init_process. Setting up here
+# means the pool semaphore and cache lock are gevent-aware instead of native threading
+# primitives that would block the whole hub while waiting.
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        # Make psycopg2 yield to the gevent hub while it waits on the server
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    from utils import reset_worker_state
+    reset_worker_state()
+
 # SSL (if needed)
 # keyfile = ""
 # certfile = ""
@@ -23,7 +23,8 @@ if [ -f /.dockerenv ] || [ "${RENDER}" = "true" ]; then
     
     # Initialize database schema
     echo -e "${BLUE}🗄️ Initializing database schema...${NC}"
-    python setup_db.py 2>/dev/null || echo -e "${YELLOW}⚠️ Database initialization completed (tables may already exist)${NC}"
+    # The schema is idempotent, so a failure here is a real error - don't start on a broken schema
+    python setup_db.py || { echo -e "${RED}❌ Database schema setup failed - check the error above${NC}"; exit 1; }
     
     # Optimize database performance
     echo -e "${BLUE}⚡ Optimizing database performance...${NC}"
@@ -38,11 +39,10 @@ if [ -f /.dockerenv ] || [ "${RENDER}" = "true" ]; then
     # Set Flask to production mode
     export FLASK_ENV=production
     export FLASK_DEBUG=false
-    export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
     
     # Start Flask with gunicorn in background
     cd /app/backend
-    gunicorn app:app --bind 0.0.0.0:5000 --workers ${WEB_CONCURRENCY:-1} --timeout 30 --access-logfile - --error-logfile - &
+    gunicorn app:app --config /app/gunicorn.conf.py &
     FLASK_PID=$!
     
     # Wait for Flask to start